@@ -0,0 +1,378 @@
+"""
+Interfaz de almacenamiento de los registros: archivos (blobs con generaciones) y documentos
+(rutas como 'registros/{trabajador}/eventos/{id}').
+
+  - FirebaseStorage: Firebase Storage + Firestore (producción).
+  - MemoryStorage: todo en memoria, con la misma semántica de generaciones, precondiciones
+    y lotes atómicos, y una latencia configurable por operación. Permite medir y probar
+    concurrencia sin un proyecto de Firebase.
+  - InstrumentedStorage: envuelve a cualquiera de los anteriores y mide cada operación
+    como una etapa de metricas.py ("almacenamiento.<operación>").
+
+Los errores son los de google.api_core.exceptions en ambas implementaciones:
+NotFound, PreconditionFailed (generación distinta) y AlreadyExists (create repetido).
+"""
+import copy
+import io
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+from google.api_core.exceptions import AlreadyExists, NotFound, PreconditionFailed
+
+from metricas import span
+
+
+@dataclass(frozen=True)
+class BlobInfo:
+    """Metadatos de un archivo: la generación cambia con cada escritura."""
+    name: str
+    generation: int
+    metadata: dict = field(default_factory=dict)
+    updated: datetime = None
+    size: int = 0
+
+
+class Increment:
+    """Suma `value` al campo actual del documento (0 si no existe) en una escritura con merge."""
+
+    def __init__(self, value):
+        self.value = value
+
+
+class StorageBackend:
+    """
+    Operaciones que usa la aplicación. Las escrituras de documentos se agrupan en lotes de
+    tuplas (operación, ruta, datos) que se aplican completos o no se aplican:
+      - ("create", ruta, datos): falla con AlreadyExists si el documento existe.
+      - ("set", ruta, datos): reemplaza el documento.
+      - ("merge", ruta, datos): actualiza solo los campos dados (acepta Increment).
+      - ("delete", ruta, None)
+    """
+
+    # --- Archivos ---
+    def get_blob(self, name):
+        """BlobInfo del archivo o None si no existe."""
+        raise NotImplementedError
+
+    def blob_exists(self, name):
+        return self.get_blob(name) is not None
+
+    def list_blobs(self, prefix=""):
+        """BlobInfo de los archivos cuyo nombre empieza con prefix, ordenados por nombre."""
+        raise NotImplementedError
+
+    def read_blob(self, name, if_generation_match=None):
+        """Contenido del archivo; con if_generation_match, solo si sigue en esa generación."""
+        raise NotImplementedError
+
+    def open_blob(self, name, chunk_size=None):
+        """Archivo de lectura binaria (por bloques de chunk_size cuando el backend lo permite)."""
+        return io.BytesIO(self.read_blob(name))
+
+    def put_blob(self, name, data, content_type=None, metadata=None, if_generation_match=None):
+        """
+        Sube el archivo y devuelve su BlobInfo. Con if_generation_match, solo se acepta si el
+        archivo sigue en esa generación (0 = que no exista); si no, PreconditionFailed.
+        """
+        raise NotImplementedError
+
+    def put_blob_file(self, name, file, content_type=None, metadata=None):
+        """Como put_blob, pero sube el contenido de un archivo abierto desde su posición actual."""
+        return self.put_blob(name, file.read(), content_type=content_type, metadata=metadata)
+
+    # --- Documentos ---
+    def get_document(self, path):
+        """Datos del documento (dict) o None si no existe."""
+        raise NotImplementedError
+
+    def set_document(self, path, data, merge=False):
+        self.write_batch([("merge" if merge else "set", path, data)])
+
+    def write_batch(self, ops):
+        raise NotImplementedError
+
+    def query_documents(self, collection, filters=(), order_by=None, group=False):
+        """
+        Documentos de la colección (ruta) que cumplen todos los filtros (campo, operador, valor).
+        Con group=True, `collection` es un id y se consultan todas las colecciones con ese id
+        (como collection_group). Devuelve una lista de (ruta, datos).
+        """
+        raise NotImplementedError
+
+
+# ---------------------------
+# FIREBASE
+# ---------------------------
+class FirebaseStorage(StorageBackend):
+    """Implementación sobre un bucket de Firebase Storage y un cliente de Firestore."""
+
+    def __init__(self, db, bucket):
+        self.db = db
+        self.bucket = bucket
+
+    @staticmethod
+    def _info(blob):
+        return BlobInfo(blob.name, blob.generation, dict(blob.metadata or {}), blob.updated, blob.size or 0)
+
+    def get_blob(self, name):
+        blob = self.bucket.get_blob(name)
+        return self._info(blob) if blob is not None else None
+
+    def list_blobs(self, prefix=""):
+        return sorted((self._info(b) for b in self.bucket.list_blobs(prefix=prefix)), key=lambda b: b.name)
+
+    def read_blob(self, name, if_generation_match=None):
+        return self.bucket.blob(name).download_as_bytes(if_generation_match=if_generation_match)
+
+    def open_blob(self, name, chunk_size=None):
+        return self.bucket.blob(name).open("rb", chunk_size=chunk_size)
+
+    def put_blob(self, name, data, content_type=None, metadata=None, if_generation_match=None):
+        blob = self.bucket.blob(name)
+        blob.metadata = metadata
+        blob.upload_from_string(data, content_type=content_type, if_generation_match=if_generation_match)
+        return self._info(blob)
+
+    def put_blob_file(self, name, file, content_type=None, metadata=None):
+        blob = self.bucket.blob(name)
+        blob.metadata = metadata
+        blob.upload_from_file(file, content_type=content_type)
+        return self._info(blob)
+
+    def get_document(self, path):
+        snapshot = self.db.document(path).get()
+        return snapshot.to_dict() if snapshot.exists else None
+
+    def write_batch(self, ops):
+        from google.cloud.firestore_v1.transforms import Increment as FirestoreIncrement
+
+        batch = self.db.batch()
+        for op, path, data in ops:
+            ref = self.db.document(path)
+            if op == "delete":
+                batch.delete(ref)
+                continue
+            data = {k: FirestoreIncrement(v.value) if isinstance(v, Increment) else v for k, v in data.items()}
+            if op == "create":
+                batch.create(ref, data)
+            else:
+                batch.set(ref, data, merge=(op == "merge"))
+        batch.commit()
+
+    def query_documents(self, collection, filters=(), order_by=None, group=False):
+        from google.cloud.firestore_v1.base_query import FieldFilter
+
+        query = self.db.collection_group(collection) if group else self.db.collection(collection)
+        for field_path, op, value in filters:
+            query = query.where(filter=FieldFilter(field_path, op, value))
+        if order_by is not None:
+            query = query.order_by(order_by)
+        return [(doc.reference.path, doc.to_dict()) for doc in query.stream()]
+
+
+# ---------------------------
+# EN MEMORIA
+# ---------------------------
+_OPERATORS = {
+    "==": lambda a, b: a == b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "in": lambda a, b: a in b,
+}
+
+
+def _merge_fields(current, data):
+    """
+    Aplica `data` sobre una copia de `current` como un set(merge=True) de Firestore:
+    los mapas anidados se combinan campo a campo y los Increment suman al valor actual.
+    """
+    result = copy.deepcopy(current)
+    for key, value in data.items():
+        if isinstance(value, Increment):
+            result[key] = result.get(key, 0) + value.value
+        elif isinstance(value, dict) and isinstance(result.get(key), dict):
+            result[key] = _merge_fields(result[key], value)
+        else:
+            result[key] = copy.deepcopy(value)
+    return result
+
+
+class MemoryStorage(StorageBackend):
+    """
+    Archivos y documentos en memoria del proceso. Las generaciones son monótonas y cada
+    operación espera `latency` segundos (fuera del candado) para simular el viaje de red,
+    así las carreras entre hilos se parecen a las reales.
+    `stats` cuenta operaciones y bytes transferidos (bytes_leidos, bytes_escritos,
+    documentos_leidos, documentos_escritos, ...), como los mediría la red.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.stats = Counter()
+        self._blobs = {}
+        self._docs = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _delay(self, operation):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.stats[operation] += 1
+
+    def _count(self, **amounts):
+        with self._lock:
+            self.stats.update(amounts)
+
+    @staticmethod
+    def _info(name, entry):
+        return BlobInfo(name, entry["generation"], dict(entry["metadata"]), entry["updated"], len(entry["data"]))
+
+    # --- Archivos ---
+    def get_blob(self, name):
+        self._delay("get_blob")
+        with self._lock:
+            entry = self._blobs.get(name)
+            return self._info(name, entry) if entry is not None else None
+
+    def list_blobs(self, prefix=""):
+        self._delay("list_blobs")
+        with self._lock:
+            return [self._info(name, entry) for name, entry in sorted(self._blobs.items())
+                    if name.startswith(prefix)]
+
+    def read_blob(self, name, if_generation_match=None):
+        self._delay("read_blob")
+        with self._lock:
+            entry = self._blobs.get(name)
+            if entry is None:
+                raise NotFound(name)
+            if if_generation_match is not None and entry["generation"] != if_generation_match:
+                raise PreconditionFailed(name)
+            self.stats["bytes_leidos"] += len(entry["data"])
+            return entry["data"]
+
+    def put_blob(self, name, data, content_type=None, metadata=None, if_generation_match=None):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self._delay("put_blob")
+        with self._lock:
+            current = self._blobs.get(name)
+            current_generation = current["generation"] if current is not None else 0
+            if if_generation_match is not None and current_generation != if_generation_match:
+                raise PreconditionFailed(name)
+            self._generation += 1
+            entry = {
+                "data": bytes(data),
+                "generation": self._generation,
+                "metadata": dict(metadata or {}),
+                "updated": datetime.now(timezone.utc),
+                "content_type": content_type,
+            }
+            self._blobs[name] = entry
+            self.stats["bytes_escritos"] += len(entry["data"])
+            return self._info(name, entry)
+
+    # --- Documentos ---
+    def get_document(self, path):
+        self._delay("get_document")
+        with self._lock:
+            data = self._docs.get(path)
+            self.stats["documentos_leidos"] += 1
+            return copy.deepcopy(data)
+
+    def write_batch(self, ops):
+        self._delay("write_batch")
+        with self._lock:
+            for op, path, _ in ops:
+                if op == "create" and path in self._docs:
+                    raise AlreadyExists(path)
+            self.stats["documentos_escritos"] += len(ops)
+            for op, path, data in ops:
+                if op == "delete":
+                    self._docs.pop(path, None)
+                    continue
+                current = self._docs.get(path) if op == "merge" else None
+                self._docs[path] = _merge_fields(current or {}, data)
+
+    def query_documents(self, collection, filters=(), order_by=None, group=False):
+        self._delay("query_documents")
+        with self._lock:
+            docs = [(path, copy.deepcopy(data)) for path, data in self._docs.items()
+                    if self._in_collection(path, collection, group)]
+        matches = [
+            (path, data) for path, data in docs
+            if all(f in data and _OPERATORS[op](data[f], value) for f, op, value in filters)
+        ]
+        if order_by is not None:
+            matches.sort(key=lambda item: item[1].get(order_by))
+        self._count(documentos_leidos=len(matches))
+        return matches
+
+    @staticmethod
+    def _in_collection(path, collection, group):
+        parent = path.rsplit("/", 1)[0]
+        if group:
+            return parent.rsplit("/", 1)[-1] == collection
+        return parent == collection
+
+
+# ---------------------------
+# INSTRUMENTACIÓN
+# ---------------------------
+class InstrumentedStorage(StorageBackend):
+    """Delega en `backend` y registra la duración y los bytes de cada operación."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get_blob(self, name):
+        with span("almacenamiento.get_blob", blob=name):
+            return self.backend.get_blob(name)
+
+    def blob_exists(self, name):
+        with span("almacenamiento.blob_exists", blob=name):
+            return self.backend.blob_exists(name)
+
+    def list_blobs(self, prefix=""):
+        with span("almacenamiento.list_blobs", prefix=prefix):
+            return self.backend.list_blobs(prefix)
+
+    def read_blob(self, name, if_generation_match=None):
+        with span("almacenamiento.read_blob", blob=name) as s:
+            data = self.backend.read_blob(name, if_generation_match=if_generation_match)
+            s.add_bytes(len(data))
+            return data
+
+    def open_blob(self, name, chunk_size=None):
+        with span("almacenamiento.open_blob", blob=name):
+            return self.backend.open_blob(name, chunk_size=chunk_size)
+
+    def put_blob(self, name, data, content_type=None, metadata=None, if_generation_match=None):
+        with span("almacenamiento.put_blob", blob=name) as s:
+            s.add_bytes(len(data))
+            return self.backend.put_blob(name, data, content_type=content_type, metadata=metadata,
+                                         if_generation_match=if_generation_match)
+
+    def put_blob_file(self, name, file, content_type=None, metadata=None):
+        with span("almacenamiento.put_blob", blob=name) as s:
+            info = self.backend.put_blob_file(name, file, content_type=content_type, metadata=metadata)
+            s.add_bytes(info.size)
+            return info
+
+    def get_document(self, path):
+        with span("almacenamiento.get_document"):
+            return self.backend.get_document(path)
+
+    def write_batch(self, ops):
+        with span("almacenamiento.write_batch", operaciones=len(ops)):
+            return self.backend.write_batch(ops)
+
+    def query_documents(self, collection, filters=(), order_by=None, group=False):
+        with span("almacenamiento.query_documents", coleccion=collection):
+            return self.backend.query_documents(collection, filters, order_by=order_by, group=group)
@@ -1,44 +1,96 @@
 import streamlit as st
 import pandas as pd
-from datetime import datetime, timedelta
+import numpy as np
+from pandas.api.types import union_categoricals
+from datetime import date, datetime, timedelta
 import pytz
 import io
-import openpyxl
-from openpyxl.utils import get_column_letter
-from openpyxl.styles import Border, Side
+import os
+# openpyxl y los clientes de Firebase se importan recién donde se usan (exportación a Excel
+# y primer acceso a Firestore/Storage) para no cargarlos en cada arranque del script.
 
 # NUEVOS IMPORTS ---------------------------------------------
 import zipfile
 import re
+import itertools
+import shutil
+import tempfile
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import random
+import threading
+import time
+import hashlib
+import zlib
+import logging
+import enum
 # ------------------------------------------------------------
 
 # ---------------------------
 # INICIALIZACIÓN DE FIREBASE
 # ---------------------------
-import firebase_admin
-from firebase_admin import credentials, firestore, storage
-
-firebase_secrets = st.secrets["firebase"]
-
-if not firebase_admin._apps:
-    cred = credentials.Certificate({
-        "type": firebase_secrets["type"],
-        "project_id": firebase_secrets["project_id"],
-        "private_key_id": firebase_secrets["private_key_id"],
-        "private_key": firebase_secrets["private_key"],
-        "client_email": firebase_secrets["client_email"],
-        "client_id": firebase_secrets["client_id"],
-        "auth_uri": firebase_secrets["auth_uri"],
-        "token_uri": firebase_secrets["token_uri"],
-        "auth_provider_x509_cert_url": firebase_secrets["auth_provider_x509_cert_url"],
-        "client_x509_cert_url": firebase_secrets["client_x509_cert_url"]
-    })
-    firebase_admin.initialize_app(cred, {
-        'storageBucket': firebase_secrets["storageBucket"]
-    })
+from google.api_core.exceptions import AlreadyExists, PreconditionFailed
+
+from almacenamiento import FirebaseStorage, Increment, InstrumentedStorage, MemoryStorage
+from metricas import BUCKETS, snapshot, span, timed
+import calendario
+
+@st.cache_resource
+def get_firebase_clients():
+    """
+    Inicializa la app de Firebase y crea los clientes de Firestore y Storage una sola vez
+    por proceso; las siguientes ejecuciones del script (y las demás sesiones) reutilizan
+    los mismos clientes y sus conexiones.
+    """
+    import firebase_admin
+    from firebase_admin import credentials, firestore, storage
+
+    firebase_secrets = st.secrets["firebase"]
+
+    if not firebase_admin._apps:
+        cred = credentials.Certificate({
+            "type": firebase_secrets["type"],
+            "project_id": firebase_secrets["project_id"],
+            "private_key_id": firebase_secrets["private_key_id"],
+            "private_key": firebase_secrets["private_key"],
+            "client_email": firebase_secrets["client_email"],
+            "client_id": firebase_secrets["client_id"],
+            "auth_uri": firebase_secrets["auth_uri"],
+            "token_uri": firebase_secrets["token_uri"],
+            "auth_provider_x509_cert_url": firebase_secrets["auth_provider_x509_cert_url"],
+            "client_x509_cert_url": firebase_secrets["client_x509_cert_url"]
+        })
+        firebase_admin.initialize_app(cred, {
+            'storageBucket': firebase_secrets["storageBucket"]
+        })
+
+    return firestore.client(), storage.bucket()
+
+_storage = None
+
+def set_storage(backend):
+    """
+    Reemplaza el almacenamiento de la aplicación (por ejemplo por un MemoryStorage en
+    benchmarks y pruebas de carga). Con None se vuelve al almacenamiento por defecto.
+    """
+    global _storage
+    _storage = InstrumentedStorage(backend) if backend is not None else None
+
+def get_storage():
+    """Almacenamiento en uso: el asignado con set_storage() o el por defecto del proceso."""
+    return _storage if _storage is not None else _default_storage()
 
-db = firestore.client()
-bucket = storage.bucket()
+@st.cache_resource
+def _default_storage():
+    """
+    Firebase, salvo que la variable de entorno REGISTROS_BACKEND sea 'memoria': en ese caso
+    se usa un almacenamiento en memoria (vacío al iniciar el proceso) con la latencia por
+    operación de REGISTROS_LATENCIA_MS, para ejecutar la app sin un proyecto de Firebase.
+    """
+    if os.environ.get("REGISTROS_BACKEND") == "memoria":
+        return InstrumentedStorage(MemoryStorage(latency=float(os.environ.get("REGISTROS_LATENCIA_MS", 0)) / 1000))
+    db, bucket = get_firebase_clients()
+    return InstrumentedStorage(FirebaseStorage(db, bucket))
 
 # ---------------------------
 # CONFIGURACIÓN DE HORARIOS
@@ -46,468 +98,1860 @@ bucket = storage.bucket()
 ENTRY_DEADLINE = 11    # Se permite marcar entrada solo hasta las 11:00 AM
 EXIT_START = 18        # Se permite marcar salida solo hasta las 6:00 PM
 
+# ---------------------------
+# BITÁCORA DE EVENTOS
+# ---------------------------
+WORKERS_COLLECTION = "registros"  # Un documento por trabajador con su último evento
+EVENTS_COLLECTION = "eventos"   # Subcolección del trabajador: un documento inmutable por marcación
+AGGREGATES_COLLECTION = "agregados"  # Totales de horas por trabajador, semana y mes
+FIRESTORE_BATCH_LIMIT = 500     # Máximo de escrituras por lote en Firestore
+CATALOG_PATH = "catalogo/semanas"  # Índice de los archivos semanales (ver list_week_files)
+PENDING_COLLECTION = "pendientes"  # Marcas de las semanas con eventos sin consolidar (ver compact_pending_weeks)
+PENDING_SHARDS = 16             # Documentos de marca por semana, para repartir las escrituras simultáneas
+NO_EXIT = "No marcó salida"
+TIMESTAMP_FORMAT = "%d/%m/%Y %I:%M:%S %p"  # Formato de Entrada/Salida en la hoja (hora de Lima)
+WEEK_COLUMNS = ["Nombre", "Fecha", "Entrada", "Salida", "Horas Trabajadas"]
+EXCEL_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+PARQUET_MIME = "application/vnd.apache.parquet"
+
+# ---------------------------
+# ESCRITURAS CONDICIONALES
+# ---------------------------
+MAX_WRITE_RETRIES = 10         # Reintentos ante una escritura concurrente sobre el mismo archivo
+RETRY_BACKOFF_SECONDS = 0.05   # Espera base; se duplica en cada intento (jitter completo)
+RETRY_BACKOFF_MAX = 1.0        # Tope de la espera entre intentos
+
+# ---------------------------
+# REPORTES
+# ---------------------------
+MONTHLY_FETCH_WORKERS = 8      # Semanas que se descargan en paralelo para el reporte mensual
+ZIP_PREFETCH = 4               # Semanas que se preparan por adelantado al armar un ZIP
+ZIP_CHUNK_SIZE = 1024 * 1024   # Tamaño de bloque para leer blobs y escribir en el ZIP
+PARQUET_FOOTER_CHUNK_SIZE = 64 * 1024  # Bloque de lectura para el pie de un Parquet (ver rebuild_catalog)
+ZIP_SPOOL_MAX_BYTES = 32 * 1024 * 1024  # Por encima de esto, el ZIP se arma en disco
+EXPORTS_PREFIX = "exportaciones/"  # Reportes ya generados, guardados en Storage (ver request_export)
+EXPORT_WORKERS = 1                 # Exportaciones que se regeneran a la vez en segundo plano
+ANALYTICS_PREFIX = "analitica/"    # Histórico compacto particionado por mes (ver query_records)
+ANALYTICS_ROW_GROUP_SIZE = 8192    # Filas por grupo en los Parquet de analitica/ (ordenados por Fecha)
+WEEK_CACHE_MAX_WEEKS = 8           # Semanas que se mantienen en la caché del proceso (las de uso más reciente)
+ANALYTICS_CACHE_MAX_PARTITIONS = 72  # Meses de analitica/ que se mantienen en la caché del proceso
+
+# Exportaciones en caché: tipo -> (nombre del archivo, tipo de contenido)
+EXPORT_KINDS = {
+    "mensual": ("registro_{year}_{month:02d}.xlsx", EXCEL_MIME),
+    "zip_mes": ("registros_{year}_{month:02d}.zip", "application/zip"),
+    "zip_todo": ("registros_all.zip", "application/zip"),
+}
+
 # ---------------------------
 # FUNCIONES AUXILIARES EXISTENTES
 # ---------------------------
-def get_week_filename():
-    """Genera el nombre del archivo según el año y la semana actual."""
-    now = datetime.now()
-    year, week, _ = now.isocalendar()
-    return f"registro_{year}_W{week}.xlsx"
+def get_week_filename(now=None):
+    """Genera el nombre del archivo según el año y la semana actual en Lima (o de la fecha dada)."""
+    return calendario.week_filename(now)
 
 def utc_to_lima(utc_dt):
     """Convierte un datetime en UTC a la hora de Lima (America/Lima)."""
-    lima_tz = pytz.timezone("America/Lima")
-    return utc_dt.astimezone(lima_tz)
+    return calendario.to_lima(utc_dt)
 
 def format_datetime(dt):
     """Formatea el datetime a cadena, usando la hora de Lima."""
-    return utc_to_lima(dt).strftime("%d/%m/%Y %I:%M:%S %p")
+    return utc_to_lima(dt).strftime(TIMESTAMP_FORMAT)
 
-def parse_timedelta(td_str):
-    """Convierte una cadena tipo 'H:MM:SS' a un objeto timedelta."""
-    try:
-        h, m, s = map(int, td_str.split(':'))
-        return timedelta(hours=h, minutes=m, seconds=s)
-    except Exception:
-        return timedelta()
+def empty_week_df():
+    """DataFrame semanal vacío con los tipos internos (las horas como duración)."""
+    df = pd.DataFrame(columns=WEEK_COLUMNS)
+    df["Horas Trabajadas"] = df["Horas Trabajadas"].astype("timedelta64[ns]")
+    return df
+
+def hours_to_timedelta(series):
+    """
+    Convierte la columna 'Horas Trabajadas' a timedelta64.
+    Acepta el formato de la hoja ('H:MM:SS' o 'No marcó salida'), segundos enteros o duraciones;
+    lo que no es una duración (por ejemplo, sin salida) queda como NaT.
+    """
+    if pd.api.types.is_timedelta64_dtype(series):
+        return series
+    if pd.api.types.is_numeric_dtype(series):
+        return pd.to_timedelta(series, unit="s")
+    return pd.to_timedelta(series.astype(object), errors="coerce")
+
+def normalize_week_df(df):
+    """Pasa un DataFrame leído de Parquet/Excel a los tipos internos."""
+    df["Horas Trabajadas"] = hours_to_timedelta(df["Horas Trabajadas"])
+    return df
+
+def format_duration(series, missing=NO_EXIT):
+    """
+    Formatea duraciones igual que str(timedelta) ('8:05:00', '1 day, 16:00:00'), de forma vectorizada.
+    Las duraciones faltantes (NaT) se muestran como `missing`.
+    """
+    seconds = series.dt.total_seconds()
+    whole = seconds.fillna(0).clip(lower=0).astype("int64")
+    days, rest = whole // 86400, whole % 86400
+    text = (
+        (rest // 3600).astype(str) + ":"
+        + (rest % 3600 // 60).astype(str).str.zfill(2) + ":"
+        + (rest % 60).astype(str).str.zfill(2)
+    )
+    prefix = days.astype(str) + " days, "
+    prefix = prefix.where(days != 1, "1 day, ")
+    text = text.where(days == 0, prefix + text).astype(object)
+    negative = seconds < 0
+    if negative.any():
+        text[negative] = series[negative].map(lambda v: str(v.to_pytimedelta()))
+    return text.where(seconds.notna(), missing)
+
+def to_sheet_layout(df):
+    """Copia del DataFrame con las horas en el formato de texto de la hoja 'Registros'."""
+    out = df.copy()
+    out["Horas Trabajadas"] = format_duration(hours_to_timedelta(out["Horas Trabajadas"]))
+    return out
 
 def create_summary_df(df):
     """Crea un DataFrame resumen con el total de horas trabajadas por cada trabajador."""
-    summary = {}
-    for name in df["Nombre"].unique():
-        valid = df[(df["Nombre"] == name) & (df["Horas Trabajadas"].notna())]
-        total = timedelta()
-        for _, row in valid.iterrows():
-            total += parse_timedelta(row["Horas Trabajadas"])
-        summary[name] = str(total)
-    summary_df = pd.DataFrame(list(summary.items()), columns=["Nombre", "Total Horas Trabajadas"])
+    totals = hours_to_timedelta(df["Horas Trabajadas"]).groupby(df["Nombre"]).sum()
+    summary_df = pd.DataFrame({
+        "Nombre": totals.index,
+        "Total Horas Trabajadas": format_duration(totals, missing="0:00:00").to_numpy()
+    })
     summary_df = summary_df.sort_values("Nombre")
     return summary_df
 
-def save_week_data_and_upload(df, filename):
+def _column_widths(df):
+    """Ancho de cada columna: el texto más largo (encabezado incluido) + 2, calculado sobre el DataFrame."""
+    widths = []
+    for col in df.columns:
+        values = df[col][df[col].notna()]
+        longest = values.astype(str).str.len().max() if not values.empty else 0
+        widths.append(max(len(str(col)), int(longest)) + 2)
+    return widths
+
+def render_workbook(sheets):
     """
-    Guarda el DataFrame en un archivo Excel con dos hojas: 'Registros' y 'Resumen',
-    ajusta las columnas, añade bordes a las celdas y sube el archivo directamente a Firebase Storage.
+    Genera un archivo Excel con una hoja por DataFrame ({nombre de hoja: DataFrame}, en orden).
+    Usa el modo de solo escritura de openpyxl (las filas se vuelcan a medida que se agregan),
+    calcula el ancho de las columnas sobre el DataFrame y aplica los bordes con un solo
+    formato condicional por hoja en lugar de asignar un Border a cada celda.
     Se utiliza un buffer en memoria, sin escribir en disco.
     """
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Registros', index=False)
-        ws = writer.sheets['Registros']
-        # Autoajuste de columnas para 'Registros'
-        for col_cells in ws.columns:
-            max_length = 0
-            col_letter = col_cells[0].column_letter
-            for cell in col_cells:
-                if cell.value:
-                    cell_length = len(str(cell.value))
-                    if cell_length > max_length:
-                        max_length = cell_length
-            ws.column_dimensions[col_letter].width = max_length + 2
-
-        summary_df = create_summary_df(df)
-        summary_df.to_excel(writer, sheet_name='Resumen', index=False)
-        ws_summary = writer.sheets['Resumen']
-        # Autoajuste de columnas para 'Resumen'
-        for col_cells in ws_summary.columns:
-            max_length = 0
-            col_letter = col_cells[0].column_letter
-            for cell in col_cells:
-                if cell.value:
-                    cell_length = len(str(cell.value))
-                    if cell_length > max_length:
-                        max_length = cell_length
-            ws_summary.column_dimensions[col_letter].width = max_length + 2
-
-        # Agregar bordes a todas las celdas en ambas hojas
-        thin_border = Border(
-            left=Side(style="thin"), 
-            right=Side(style="thin"), 
-            top=Side(style="thin"), 
-            bottom=Side(style="thin")
-        )
-        for ws_sheet in [writer.sheets['Registros'], writer.sheets['Resumen']]:
-            for row in ws_sheet.iter_rows():
-                for cell in row:
-                    cell.border = thin_border
+    with span("excel.generar", hojas=len(sheets)) as s:
+        output = _render_workbook(sheets)
+        s.add_bytes(output.getbuffer().nbytes)
+    return output
+
+def _render_workbook(sheets):
+    import openpyxl
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.formatting.rule import FormulaRule
+    from openpyxl.utils import get_column_letter
+    from openpyxl.styles import Alignment, Border, Font, Side
+
+    thin = Side(style="thin")
+    border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    header_font = Font(bold=True)
+    header_alignment = Alignment(horizontal="center", vertical="top")
+
+    wb = openpyxl.Workbook(write_only=True)
+    for sheet_name, df in sheets.items():
+        ws = wb.create_sheet(sheet_name)
+        for idx, width in enumerate(_column_widths(df), start=1):
+            ws.column_dimensions[get_column_letter(idx)].width = width
+        if len(df.columns):
+            used_range = f"A1:{get_column_letter(len(df.columns))}{len(df) + 1}"
+            ws.conditional_formatting.add(used_range, FormulaRule(formula=["TRUE"], border=border))
 
+        header = []
+        for col in df.columns:
+            cell = WriteOnlyCell(ws, value=str(col))
+            cell.font = header_font
+            cell.alignment = header_alignment
+            header.append(cell)
+        ws.append(header)
+        values = df.astype(object).where(df.notna(), None)
+        for row in values.itertuples(index=False, name=None):
+            ws.append(row)
+
+    output = io.BytesIO()
+    wb.save(output)
     output.seek(0)
-    blob = bucket.blob(filename)
-    blob.upload_from_string(output.read(), content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    st.write(f"Archivo {filename} subido a Firebase Storage.")
+    return output
+
+def build_week_excel(df):
+    """Genera el archivo Excel de la semana con dos hojas: 'Registros' y 'Resumen'."""
+    return render_workbook({
+        "Registros": to_sheet_layout(df),
+        "Resumen": create_summary_df(df)
+    })
+
+def parquet_name(filename):
+    """Nombre del blob Parquet (copia canónica de los datos) para un archivo semanal .xlsx."""
+    return filename[:-len(".xlsx")] + ".parquet"
+
+def save_week_data_and_upload(df, filename, metadata=None, if_generation_match=None):
+    """
+    Guarda el DataFrame de la semana en Parquet y lo sube a Firebase Storage junto al Excel.
+    La copia Parquet es la fuente de verdad para todas las lecturas internas; el Excel con estilo
+    solo se genera cuando alguien lo descarga (ver week_excel_bytes).
+    Si se indica if_generation_match, la subida solo se acepta si el archivo sigue en esa
+    generación (0 = que no exista); de lo contrario Storage lanza PreconditionFailed.
+    Devuelve la generación del archivo subido.
+    """
+    with span("parquet.escribir", filas=len(df)) as s:
+        output = io.BytesIO()
+        df.to_parquet(output, index=False)
+        s.add_bytes(output.getbuffer().nbytes)
+    blob = get_storage().put_blob(
+        parquet_name(filename),
+        output.getvalue(),
+        content_type=PARQUET_MIME,
+        metadata=metadata,
+        if_generation_match=if_generation_match
+    )
+    # Lo que acabamos de subir ya es la versión vigente: se guarda en caché sin volver a descargarla,
+    # leída de los mismos bytes para que tenga los tipos de cualquier otra lectura del Parquet.
+    _put_cached_week(blob.name, blob.generation, normalize_week_df(pd.read_parquet(output)))
+    update_catalog(filename, blob, len(df))
+    return blob.generation
+
+def week_excel_bytes(filename, cache=True):
+    """
+    Genera al vuelo el Excel con estilo de la semana (datos consolidados + eventos pendientes).
+    Con cache=False, la semana leída no queda en la caché del proceso (ver load_week_data).
+    """
+    return build_week_excel(load_week_data(filename, cache=cache)).getvalue()
+
+def migrate_week_to_parquet(filename, overwrite=False):
+    """
+    Crea la copia Parquet de un archivo semanal .xlsx existente.
+    Sin overwrite, no toca las semanas que ya tienen Parquet (la subida exige que no exista).
+    Devuelve True si se escribió el Parquet.
+    """
+    storage = get_storage()
+    legacy = storage.get_blob(filename)
+    if legacy is None:
+        return False
+    data = storage.read_blob(filename, if_generation_match=legacy.generation)
+    df = normalize_week_df(pd.read_excel(io.BytesIO(data), sheet_name='Registros'))
+    try:
+        save_week_data_and_upload(df, filename, legacy.metadata, if_generation_match=None if overwrite else 0)
+    except PreconditionFailed:
+        return False
+    return True
+
+def _read_week_blob(filename, cache=True):
+    """Lee los registros consolidados de la semana. Si no existen, devuelve un DataFrame vacío."""
+    df, _, _ = _read_week_blob_versioned(filename, cache=cache)
+    return df
+
+def _read_week_blob_versioned(filename, cache=True):
+    """
+    Lee los registros de la semana desde su copia Parquet, junto con la generación y los
+    metadatos del blob. La descarga se condiciona a la generación leída, así el DataFrame
+    corresponde exactamente a esa versión. Si el Parquet no existe, la generación es 0.
+    Solo se consultan los metadatos del blob: si la generación coincide con la que
+    está en caché, no se descarga ni se vuelve a leer el archivo. Con cache=False, lo leído
+    no se guarda en la caché (lecturas de muchas semanas que se usan una sola vez).
+    """
+    blob = get_storage().get_blob(parquet_name(filename))
+    if blob is None:
+        return _read_legacy_week_excel(filename, cache=cache), 0, {}
+    return _read_parquet_week(blob, cache=cache), blob.generation, blob.metadata
+
+def _read_parquet_week(blob, cache=True, copy=True):
+    """
+    Registros de la semana desde la versión dada de su Parquet (de la caché si está).
+    Con copy=False se devuelve el DataFrame de la caché, que no se debe modificar.
+    """
+    cached = _get_cached_week(blob.name, blob.generation)
+    if cached is None:
+        data = get_storage().read_blob(blob.name, if_generation_match=blob.generation)
+        with span("parquet.leer", blob=blob.name) as s:
+            s.add_bytes(len(data))
+            cached = normalize_week_df(pd.read_parquet(io.BytesIO(data)))
+        if cache:
+            _put_cached_week(blob.name, blob.generation, cached)
+    return cached.copy() if copy else cached
+
+def _read_legacy_week_excel(filename, cache=True, copy=True):
+    """
+    Lee una semana que todavía no tiene copia Parquet desde su Excel original.
+    La primera escritura de esa semana crea el Parquet (generación 0 = que no exista).
+    Con copy=False se devuelve el DataFrame de la caché, que no se debe modificar.
+    """
+    storage = get_storage()
+    blob = storage.get_blob(filename)
+    if blob is None:
+        return empty_week_df()
+    cached = _get_cached_week(blob.name, blob.generation)
+    if cached is None:
+        data = storage.read_blob(blob.name, if_generation_match=blob.generation)
+        with span("excel.leer", blob=blob.name) as s:
+            s.add_bytes(len(data))
+            cached = normalize_week_df(pd.read_excel(io.BytesIO(data), sheet_name='Registros'))
+        if cache:
+            _put_cached_week(blob.name, blob.generation, cached)
+    return cached.copy() if copy else cached
+
+@st.cache_resource
+def _week_cache():
+    """
+    Cachés compartidas por todas las sesiones del proceso: nombre del blob -> (generación, DataFrame),
+    una para las semanas y otra para las particiones de analítica. Cada una tiene un máximo de
+    entradas y descarta la de uso menos reciente. Una generación distinta en Storage invalida la entrada.
+    """
+    return {"lock": threading.Lock(), "weeks": OrderedDict(), "analytics": OrderedDict()}
+
+def _cache_bucket(cache, blob_name):
+    """Caché (y su máximo de entradas) que corresponde al blob."""
+    if blob_name.startswith(ANALYTICS_PREFIX):
+        return cache["analytics"], ANALYTICS_CACHE_MAX_PARTITIONS
+    return cache["weeks"], WEEK_CACHE_MAX_WEEKS
+
+def _get_cached_week(blob_name, generation):
+    cache = _week_cache()
+    entries, _ = _cache_bucket(cache, blob_name)
+    with cache["lock"]:
+        entry = entries.get(blob_name)
+        if entry is None or entry[0] != generation:
+            return None
+        entries.move_to_end(blob_name)
+    return entry[1]
+
+def _put_cached_week(blob_name, generation, df):
+    cache = _week_cache()
+    entries, max_entries = _cache_bucket(cache, blob_name)
+    df = df.copy()
+    with cache["lock"]:
+        entries[blob_name] = (generation, df)
+        entries.move_to_end(blob_name)
+        while len(entries) > max_entries:
+            entries.popitem(last=False)
+
+def update_week_blob(filename, mutate, max_retries=MAX_WRITE_RETRIES):
+    """
+    Lectura-modificación-escritura optimista del archivo semanal.
+    mutate(df, metadata) devuelve (df_nuevo, metadata_nueva), o None si no hay nada que escribir.
+    La subida usa la generación leída como precondición; si otro proceso escribió en medio,
+    se vuelve a leer y se aplica mutate sobre la versión nueva (así se combinan ambos cambios).
+    Devuelve True si se escribió, False si mutate no tenía cambios.
+    """
+    for attempt in range(max_retries):
+        try:
+            df, generation, metadata = _read_week_blob_versioned(filename)
+            result = mutate(df, metadata)
+            if result is None:
+                return False
+            new_df, new_metadata = result
+            save_week_data_and_upload(new_df, filename, new_metadata, if_generation_match=generation)
+            return True
+        except PreconditionFailed:
+            backoff = min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_SECONDS * (2 ** attempt))
+            time.sleep(random.uniform(0, backoff))
+    raise RuntimeError(
+        f"No se pudo actualizar {filename}: demasiadas escrituras concurrentes ({max_retries} intentos)."
+    )
+
+def load_week_data(filename, cache=True):
+    """
+    Carga los registros de la semana: los datos ya consolidados en Firebase Storage (Parquet)
+    más los eventos de la bitácora que todavía no se han consolidado.
+    Con cache=False, la semana leída no queda en la caché del proceso.
+    """
+    df = _read_week_blob(filename, cache=cache)
+    return merge_events(df, load_week_events(filename))
+
+def event_doc_id(date_str, event_type):
+    """ID determinista del evento: como máximo una entrada y una salida por trabajador y día."""
+    return f"{date_str}_{event_type}"
+
+def worker_path(worker):
+    return f"{WORKERS_COLLECTION}/{worker}"
+
+def event_path(worker, date_str, event_type):
+    """Documento del evento en el historial del trabajador: registros/{trabajador}/eventos/{fecha}_{tipo}."""
+    return f"{worker_path(worker)}/{EVENTS_COLLECTION}/{event_doc_id(date_str, event_type)}"
 
-def load_week_data(filename):
+def append_event(worker, date_str, event_type, data):
     """
-    Intenta cargar el DataFrame de la hoja 'Registros' desde Firebase Storage.
-    Si no existe, se crea uno nuevo y se sube.
+    Agrega un evento inmutable al historial del trabajador. Usa create(), por lo que lanza
+    AlreadyExists si el evento de ese tipo ya fue registrado hoy para el trabajador.
+    En el mismo lote (atómico) se actualizan los totales semanal y mensual del trabajador
+    (una salida suma sus SegundosTrabajados; una entrada solo asegura que el trabajador
+    aparezca en el resumen de la semana) y el último evento en registros/{trabajador}.
     """
-    blob = bucket.blob(filename)
-    if blob.exists():
-        data = blob.download_as_bytes()
-        df = pd.read_excel(io.BytesIO(data), sheet_name='Registros')
+    ops = _event_ops(worker, date_str, event_type, data)
+    ops.append(("set", worker_path(worker), {
+        "Fecha": date_str,
+        "Evento": event_type,
+        "Timestamp": data["Timestamp"]
+    }))
+    get_storage().write_batch(ops)
+
+def _event_ops(worker, date_str, event_type, data):
+    """Escrituras de un evento nuevo: su creación, los incrementos de sus totales y la marca de semana pendiente."""
+    ops = [("create", event_path(worker, date_str, event_type), data)]
+    for agg_path, fields in _aggregate_increments(worker, data["Semana"], date_str, data.get("SegundosTrabajados")):
+        ops.append(("merge", agg_path, fields))
+    ops.append(("set", pending_marker_path(data["Semana"], worker), {"Archivo": data["Semana"]}))
+    return ops
+
+def get_event(worker, date_str, event_type):
+    """Devuelve el evento registrado (como dict) o None si no existe."""
+    return get_storage().get_document(event_path(worker, date_str, event_type))
+
+def load_week_events(filename):
+    """Devuelve todos los eventos (de todos los trabajadores) que pertenecen al archivo semanal dado."""
+    docs = get_storage().query_documents(EVENTS_COLLECTION, [("Semana", "==", filename)], group=True)
+    return [data for _, data in docs]
+
+def get_worker_records(worker, start_date, end_date):
+    """
+    Registros de un trabajador entre dos fechas 'YYYY-MM-DD' (inclusive), en el formato de la hoja.
+    Es una consulta de rango sobre el historial del trabajador en Firestore: no descarga
+    ni lee archivos semanales.
+    """
+    docs = get_storage().query_documents(
+        f"{worker_path(worker)}/{EVENTS_COLLECTION}",
+        [("Fecha", ">=", start_date), ("Fecha", "<=", end_date)],
+        order_by="Fecha"
+    )
+    df = events_to_week_df([data for _, data in docs])
+    return df.sort_values("Fecha", kind="stable").reset_index(drop=True)
+
+def events_to_week_df(events):
+    """Convierte eventos de la bitácora al formato de la hoja 'Registros' (una fila por trabajador y día)."""
+    rows = {}
+    entries = {}
+    for event in sorted(events, key=lambda e: e["TimestampUTC"]):
+        key = (event["Nombre"], event["Fecha"])
+        row = rows.setdefault(key, {
+            "Nombre": event["Nombre"],
+            "Fecha": event["Fecha"],
+            "Entrada": None,
+            "Salida": NO_EXIT,
+            "Horas Trabajadas": pd.NaT
+        })
+        if event["Evento"] == "entrada":
+            row["Entrada"] = event["Timestamp"]
+            entries[key] = event
+        elif event["Evento"] == "salida":
+            row["Salida"] = event["Timestamp"]
+            if "SegundosTrabajados" in event:
+                row["Horas Trabajadas"] = pd.Timedelta(seconds=event["SegundosTrabajados"])
+            elif key in entries:
+                # Salidas antiguas sin SegundosTrabajados: se restan los instantes UTC guardados
+                row["Horas Trabajadas"] = pd.Timedelta(seconds=_event_epoch(event) - _event_epoch(entries[key]))
+            else:
+                row["Horas Trabajadas"] = pd.to_timedelta(event["Horas Trabajadas"], errors="coerce")
+    if not rows:
+        return empty_week_df()
+    return normalize_week_df(pd.DataFrame(list(rows.values()), columns=WEEK_COLUMNS))
+
+def merge_events(df, events):
+    """
+    Combina las filas del archivo semanal con las de la bitácora, campo por campo: para un
+    mismo trabajador y día, la entrada de la bitácora reemplaza a la del archivo solo si hay
+    un evento de entrada, y la salida (con sus horas) solo si hay un evento de salida. Así una
+    fila ya consolidada no pierde la salida ni las horas por un evento que no las tiene.
+    """
+    if not events:
         return df
+    df_events = events_to_week_df(events)
+    keys = ["Nombre", "Fecha"]
+    merged = df.merge(df_events[keys], on=keys, how="left", indicator=True)
+    keep = (merged["_merge"] == "left_only").to_numpy()
+
+    stored = df.drop_duplicates(keys, keep="last")
+    combined = df_events.merge(stored, on=keys, how="left", suffixes=("", "_archivo"))
+    has_entry = combined["Entrada"].notna()
+    has_exit = combined["Salida"] != NO_EXIT
+    combined["Entrada"] = combined["Entrada"].where(has_entry, combined["Entrada_archivo"])
+    combined["Salida"] = combined["Salida"].where(has_exit, combined["Salida_archivo"].fillna(NO_EXIT))
+    combined["Horas Trabajadas"] = combined["Horas Trabajadas"].where(
+        has_exit, combined["Horas Trabajadas_archivo"]
+    )
+    return pd.concat([df[keep], combined[WEEK_COLUMNS]], ignore_index=True)
+
+def consolidated_events(df, filename):
+    """
+    Eventos equivalentes a las filas ya consolidadas del archivo semanal, como
+    {(trabajador, fecha, tipo): evento}. Cubren las marcaciones que no están en la bitácora
+    (anteriores a ella, o de semanas en las que no se ejecutó poblar-historial) y solo se usan
+    para validar marcaciones nuevas: no se escriben.
+    """
+    events = {}
+    if df.empty:
+        return events
+    entries = _sheet_times_to_utc(df["Entrada"])
+    exits = _sheet_times_to_utc(df["Salida"])
+    hours = hours_to_timedelta(df["Horas Trabajadas"])
+    for name, fecha, entry_text, entry_utc, exit_text, exit_utc, worked in zip(
+        df["Nombre"], df["Fecha"].astype(str), df["Entrada"], entries, df["Salida"], exits, hours
+    ):
+        for event_type, text, utc in (("entrada", entry_text, entry_utc), ("salida", exit_text, exit_utc)):
+            if pd.isna(utc):
+                continue
+            event = {
+                "Nombre": name,
+                "Fecha": fecha,
+                "Semana": filename,
+                "Evento": event_type,
+                "Timestamp": text,
+                "TimestampUTC": utc.to_pydatetime(),
+                "EpochUTC": calendario.epoch_seconds(utc)
+            }
+            if event_type == "salida" and not pd.isna(worked):
+                seconds = int(worked.total_seconds())
+                event["SegundosTrabajados"] = seconds
+                event["Horas Trabajadas"] = str(timedelta(seconds=seconds))
+            events[(name, fecha, event_type)] = event
+    return events
+
+def _unlogged_punches(df, events):
+    """Marcaciones (entradas y salidas) de las filas del archivo que no tienen su evento en la bitácora."""
+    keys = df["Nombre"].astype(str) + "|" + df["Fecha"].astype(str)
+    unlogged = 0
+    for event_type, column in (("entrada", "Entrada"), ("salida", "Salida")):
+        logged = {f"{e['Nombre']}|{e['Fecha']}" for e in events if e["Evento"] == event_type}
+        unlogged += int((_sheet_times_to_utc(df[column]).notna() & ~keys.isin(logged)).sum())
+    return unlogged
+
+def _consolidated_day(worker, date_str, filename):
+    """
+    Eventos {tipo: evento} del trabajador y día según el archivo semanal ya consolidado.
+    Si la consolidación registró que todas las marcaciones del archivo tienen su evento
+    (metadato marcaciones_sin_eventos), no hay nada que leer: basta la bitácora. Si no, se
+    filtra la semana de la caché sin copiarla.
+    """
+    blob = get_storage().get_blob(parquet_name(filename))
+    if blob is None:
+        df = _read_legacy_week_excel(filename, copy=False)
+    elif blob.metadata.get("marcaciones_sin_eventos") == "0":
+        return {}
     else:
-        df = pd.DataFrame(columns=["Nombre", "Fecha", "Entrada", "Salida", "Horas Trabajadas"])
-        save_week_data_and_upload(df, filename)
-        st.write(f"Nuevo archivo para la semana creado: {filename}")
-        return df
+        df = _read_parquet_week(blob, copy=False)
+    day = df[((df["Nombre"] == worker) & (df["Fecha"] == date_str)).to_numpy()]
+    return {event_type: e for (_, _, event_type), e in consolidated_events(day, filename).items()}
 
-def update_firestore(worker, data):
+@timed("consolidacion")
+def compact_week(filename):
     """
-    Actualiza Firestore en la colección 'registros'.
-    Cada trabajador tendrá un documento cuyo ID es su nombre, y se guardan los registros.
+    Consolida los eventos de la bitácora en los datos semanales (copia Parquet).
+    La bitácora solo crece, así que basta comparar la cantidad de eventos con la guardada
+    en los metadatos del archivo para saber si hay algo nuevo que consolidar.
+    La escritura es condicional (update_week_blob): dos consolidaciones simultáneas no se pisan
+    y nunca se reemplaza una consolidación más completa por otra más vieja. También se guarda
+    cuántas marcaciones del archivo no tienen evento (ver _consolidated_day).
+    Devuelve True si el archivo fue regenerado.
     """
-    doc_ref = db.collection("registros").document(worker)
-    doc_ref.set(data)
+    events = load_week_events(filename)
+    if not events:
+        return False
+    blob = get_storage().get_blob(parquet_name(filename))
+    if blob is not None and blob.metadata.get("eventos_consolidados") == str(len(events)):
+        return False
+
+    def consolidate(df, metadata):
+        if int(metadata.get("eventos_consolidados", 0)) >= len(events):
+            return None
+        merged = merge_events(df, events)
+        return merged, {"eventos_consolidados": str(len(events)),
+                        "marcaciones_sin_eventos": str(_unlogged_punches(merged, events))}
+
+    return update_week_blob(filename, consolidate)
 
-def register_event(worker, event_type):
+def pending_marker_path(filename, worker):
     """
-    Registra una entrada o salida para un trabajador.
-    Se actualiza Firestore y se actualiza el archivo Excel en Firebase Storage.
-    Se convierte la hora de UTC a la hora de Lima.
-    Se validan horarios:
+    Marca de que la semana tiene eventos sin consolidar; se escribe en el mismo lote que cada
+    evento. Cada semana reparte sus marcas en PENDING_SHARDS documentos (según el trabajador),
+    así las marcaciones simultáneas no escriben todas sobre el mismo documento.
+    """
+    shard = zlib.crc32(worker.encode("utf-8")) % PENDING_SHARDS
+    return f"{PENDING_COLLECTION}/{week_key(filename)}_{shard}"
+
+def _pending_markers():
+    """Rutas de las marcas pendientes, agrupadas por archivo semanal (una sola consulta)."""
+    markers = {}
+    for path, data in get_storage().query_documents(PENDING_COLLECTION):
+        markers.setdefault(data["Archivo"], []).append(path)
+    return markers
+
+def compact_pending_weeks():
+    """
+    Consolida todas las semanas con marcas pendientes, sin importar su antigüedad, más la
+    actual y la anterior (eventos escritos antes de que existieran las marcas).
+    Las marcas de cada semana se borran antes de leer sus eventos: un evento que llega después
+    vuelve a crear la suya y queda para la próxima vez. Si la consolidación falla, las marcas
+    se restauran. Devuelve los archivos que fueron regenerados.
+    """
+    markers = _pending_markers()
+    now = calendario.now_lima()
+    for filename in (get_week_filename(now - timedelta(weeks=1)), get_week_filename(now)):
+        markers.setdefault(filename, [])
+    storage = get_storage()
+    compacted = []
+    for filename, paths in markers.items():
+        if paths:
+            storage.write_batch([("delete", path, None) for path in paths])
+        try:
+            if compact_week(filename):
+                compacted.append(filename)
+        except Exception:
+            if paths:
+                storage.write_batch([("set", path, {"Archivo": filename}) for path in paths])
+            raise
+    return compacted
+
+DUPLICATE_EVENT_MESSAGES = {
+    "entrada": "Ya se ha registrado una entrada hoy para este trabajador.",
+    "salida": "Ya se ha registrado una salida hoy para este trabajador."
+}
+NO_ENTRY_MESSAGE = "No se ha registrado entrada hoy para este trabajador."
+
+def validate_event_time(event_type, local_now):
+    """
+    Valida el horario de una marcación (hora de Lima). Devuelve el motivo del rechazo,
+    o None si está permitida:
       - Entrada: solo se permite hasta las 11:00 AM.
       - Salida: solo se permite hasta las 6:00 PM.
-    Si no se marcó entrada, no se permite marcar salida.
     """
-    filename = get_week_filename()
-    df = load_week_data(filename)
-    today_str = datetime.now().strftime("%Y-%m-%d")
-    
-    now_utc = datetime.now(pytz.utc)
-    local_now = utc_to_lima(now_utc)
-    now_str = format_datetime(now_utc)
-    
-    # Validar horario según tipo de evento
     if event_type == "entrada":
         if local_now.hour >= ENTRY_DEADLINE:
-            return False, "Fuera del horario permitido para marcar entrada (hasta las 11:00 AM)."
+            return "Fuera del horario permitido para marcar entrada (hasta las 11:00 AM)."
     elif event_type == "salida":
         if local_now.hour > EXIT_START or (local_now.hour == EXIT_START and local_now.minute > 0):
-            return False, "Fuera del horario permitido para marcar salida (hasta las 6:00 PM)."
-    
-    record = df[(df["Nombre"] == worker) & (df["Fecha"] == today_str)]
-    
-    if event_type == "entrada":
-        if not record.empty and pd.notna(record.iloc[0]["Entrada"]):
-            return False, "Ya se ha registrado una entrada hoy para este trabajador."
-        if record.empty:
-            new_row = {
-                "Nombre": worker,
-                "Fecha": today_str,
-                "Entrada": now_str,
-                "Salida": "No marcó salida",
-                "Horas Trabajadas": "No marcó salida"
-            }
-            df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-        else:
-            idx = record.index[0]
-            df.at[idx, "Entrada"] = now_str
-        save_week_data_and_upload(df, filename)
-        update_firestore(worker, {"Fecha": today_str, "Evento": "entrada", "Timestamp": now_str})
-        return True, f"Entrada registrada para {worker} a las {now_str}"
-    
-    elif event_type == "salida":
-        if record.empty or pd.isna(record.iloc[0]["Entrada"]):
-            return False, "No se ha registrado entrada hoy para este trabajador."
-        if pd.notna(record.iloc[0]["Salida"]) and record.iloc[0]["Salida"] != "No marcó salida":
-            return False, "Ya se ha registrado una salida hoy para este trabajador."
-        
-        idx = record.index[0]
-        df.at[idx, "Salida"] = now_str
+            return "Fuera del horario permitido para marcar salida (hasta las 6:00 PM)."
+    else:
+        return "Evento desconocido."
+    return None
+
+def new_event(worker, event_type, now_utc):
+    """Documento del evento; la fecha y la semana son las del día en Lima, el mismo que se valida."""
+    local_now = utc_to_lima(now_utc)
+    return {
+        "Nombre": worker,
+        "Fecha": calendario.date_str(local_now),
+        "Semana": get_week_filename(local_now),
+        "Evento": event_type,
+        "Timestamp": format_datetime(now_utc),
+        "TimestampUTC": now_utc,
+        "EpochUTC": calendario.epoch_seconds(now_utc)
+    }
+
+def _event_epoch(event):
+    """Segundos UTC del evento; los eventos anteriores a EpochUTC solo tienen TimestampUTC."""
+    if "EpochUTC" in event:
+        return event["EpochUTC"]
+    return calendario.epoch_seconds(event["TimestampUTC"])
+
+def add_worked_time(event, entry):
+    """
+    Agrega a un evento de salida los segundos trabajados desde la entrada dada, restando
+    los instantes UTC guardados (sin volver a interpretar los textos de la hoja).
+    """
+    # Misma resolución de segundos que las horas mostradas en la hoja
+    worked = _event_epoch(event) - _event_epoch(entry)
+    event["SegundosTrabajados"] = worked
+    event["Horas Trabajadas"] = str(timedelta(seconds=worked))
+
+@timed("marcacion")
+def register_event(worker, event_type, now_utc=None):
+    """
+    Registra una entrada o salida para un trabajador.
+    now_utc es el momento de la marcación (por defecto, ahora); las pruebas de carga lo
+    fijan para marcar dentro del horario permitido.
+    Cada marcación se guarda como un evento inmutable en el historial del trabajador en Firestore;
+    el archivo Excel semanal se construye después a partir de esos eventos (ver compact_week),
+    por lo que el costo de marcar no depende del tamaño de la semana.
+    Se convierte la hora de UTC a la hora de Lima y se valida el horario (validate_event_time).
+    Si no se marcó entrada, no se permite marcar salida. Las marcaciones que solo están en el
+    archivo semanal (anteriores a la bitácora) también cuentan (ver consolidated_events).
+    """
+    if now_utc is None:
+        now_utc = calendario.now_utc()
+
+    error = validate_event_time(event_type, utc_to_lima(now_utc))
+    if error:
+        return False, error
+
+    event = new_event(worker, event_type, now_utc)
+    today_str, now_str = event["Fecha"], event["Timestamp"]
+
+    consolidated = _consolidated_day(worker, today_str, event["Semana"])
+    if event_type in consolidated:
+        return False, DUPLICATE_EVENT_MESSAGES[event_type]
+    if event_type == "salida":
+        entry = get_event(worker, today_str, "entrada") or consolidated.get("entrada")
+        if entry is None:
+            return False, NO_ENTRY_MESSAGE
         try:
-            entry_time = datetime.strptime(df.at[idx, "Entrada"], "%d/%m/%Y %I:%M:%S %p")
-            exit_time = datetime.strptime(now_str, "%d/%m/%Y %I:%M:%S %p")
-            worked = exit_time - entry_time
-            df.at[idx, "Horas Trabajadas"] = str(worked)
+            add_worked_time(event, entry)
         except Exception as e:
             return False, f"Error al calcular las horas trabajadas: {e}"
-        save_week_data_and_upload(df, filename)
-        update_firestore(worker, {"Fecha": today_str, "Evento": "salida", "Timestamp": now_str})
-        return True, f"Salida registrada para {worker} a las {now_str}"
-    
-    return False, "Evento desconocido."
+
+    try:
+        append_event(worker, today_str, event_type, event)
+    except AlreadyExists:
+        return False, DUPLICATE_EVENT_MESSAGES[event_type]
+    return True, f"{event_type.capitalize()} registrada para {worker} a las {now_str}"
+
+# ---------------------------
+# IMPORTACIÓN MASIVA DE MARCACIONES
+# ---------------------------
+def parse_event_timestamp(value):
+    """
+    Convierte la hora de una marcación importada a datetime UTC. Acepta ISO 8601
+    ('2024-03-04T08:55:00-05:00'; sin zona horaria se asume hora de Lima) o el formato
+    de la hoja ('04/03/2024 08:55:00 AM', hora de Lima).
+    """
+    value = str(value).strip()
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        parsed = datetime.strptime(value, TIMESTAMP_FORMAT)
+    if parsed.tzinfo is None:
+        parsed = calendario.localize_lima(parsed)
+    return parsed.astimezone(pytz.utc)
+
+def _write_imported_events(events):
+    """
+    Escribe los eventos en lotes de Firestore. En cada lote, los incrementos de un mismo
+    total se suman en una sola escritura. Si un lote choca con una marcación hecha en
+    paralelo (AlreadyExists), sus eventos se escriben de a uno (cada uno con sus totales)
+    y los repetidos se descartan. No se toca el último evento en registros/{trabajador}.
+    Devuelve (escritos, [(evento, motivo)] descartados).
+    """
+    storage = get_storage()
+    written, skipped = [], []
+    # Cada evento ocupa como máximo cuatro escrituras: el evento, sus dos totales y la marca de semana
+    chunk_size = FIRESTORE_BATCH_LIMIT // 4
+    for start in range(0, len(events), chunk_size):
+        chunk = events[start:start + chunk_size]
+        ops = [("create", event_path(e["Nombre"], e["Fecha"], e["Evento"]), e) for e in chunk]
+        totals = {}
+        for e in chunk:
+            for path, fields in _aggregate_increments(e["Nombre"], e["Semana"], e["Fecha"], e.get("SegundosTrabajados")):
+                if path in totals:
+                    for key in ("Segundos", "Turnos"):
+                        fields[key] = Increment(totals[path][key].value + fields[key].value)
+                totals[path] = fields
+        ops += [("merge", path, fields) for path, fields in totals.items()]
+        markers = {pending_marker_path(e["Semana"], e["Nombre"]): e["Semana"] for e in chunk}
+        ops += [("set", path, {"Archivo": filename}) for path, filename in markers.items()]
+        try:
+            storage.write_batch(ops)
+            written += chunk
+        except AlreadyExists:
+            for e in chunk:
+                try:
+                    storage.write_batch(_event_ops(e["Nombre"], e["Fecha"], e["Evento"], e))
+                    written.append(e)
+                except AlreadyExists:
+                    skipped.append((e, DUPLICATE_EVENT_MESSAGES[e["Evento"]]))
+    return written, skipped
+
+@timed("importacion")
+def import_events(records, dry_run=False):
+    """
+    Importa marcaciones en bloque (kioscos sin conexión, correcciones). Cada registro es un
+    dict con 'Nombre', 'Evento' ('entrada'/'salida') y 'Timestamp' (ver parse_event_timestamp).
+    Se aplican las mismas reglas que en register_event, pero con la hora de cada registro:
+    horario permitido, una entrada y una salida por día, y salida solo después de una entrada
+    (en la bitácora, en el archivo semanal o importada en el mismo bloque). Los registros se
+    procesan en orden de hora. Los eventos existentes se leen con una consulta y el archivo de
+    cada semana afectada, los nuevos se escriben en lotes (_write_imported_events) y al final
+    cada semana afectada se consolida una sola vez (compact_week). El último evento en
+    registros/{trabajador} no se modifica.
+    Devuelve (eventos importados, [(número de registro, registro, motivo)] rechazados).
+    """
+    rejected = []
+    parsed = []
+    for i, record in enumerate(records, start=1):
+        try:
+            worker = str(record["Nombre"]).strip()
+            event_type = str(record["Evento"]).strip().lower()
+            now_utc = parse_event_timestamp(record["Timestamp"])
+        except (KeyError, TypeError, ValueError) as e:
+            rejected.append((i, record, f"Registro inválido: {e!r}"))
+            continue
+        if not worker:
+            rejected.append((i, record, "Registro inválido: falta el nombre del trabajador."))
+            continue
+        parsed.append((now_utc, i, record, worker, event_type))
+
+    known = {}  # semana -> {(trabajador, fecha, tipo): evento}
+    accepted = []
+    positions = {}
+    for now_utc, i, record, worker, event_type in sorted(parsed, key=lambda p: (p[0], p[1])):
+        error = validate_event_time(event_type, utc_to_lima(now_utc))
+        if error:
+            rejected.append((i, record, error))
+            continue
+        event = new_event(worker, event_type, now_utc)
+        week = known.get(event["Semana"])
+        if week is None:
+            # Lo ya consolidado en el archivo cuenta aunque no esté en la bitácora
+            week = known[event["Semana"]] = consolidated_events(_read_week_blob(event["Semana"]), event["Semana"])
+            week.update({(e["Nombre"], e["Fecha"], e["Evento"]): e for e in load_week_events(event["Semana"])})
+        if (worker, event["Fecha"], event_type) in week:
+            rejected.append((i, record, DUPLICATE_EVENT_MESSAGES[event_type]))
+            continue
+        if event_type == "salida":
+            entry = week.get((worker, event["Fecha"], "entrada"))
+            if entry is None:
+                rejected.append((i, record, NO_ENTRY_MESSAGE))
+                continue
+            add_worked_time(event, entry)
+        week[(worker, event["Fecha"], event_type)] = event
+        accepted.append(event)
+        positions[id(event)] = (i, record)
+
+    if dry_run or not accepted:
+        return accepted, sorted(rejected, key=lambda r: r[0])
+
+    written, skipped = _write_imported_events(accepted)
+    rejected += [(*positions[id(e)], reason) for e, reason in skipped]
+    for filename in sorted({e["Semana"] for e in written}):
+        compact_week(filename)
+    return written, sorted(rejected, key=lambda r: r[0])
+
+def _sheet_times_to_utc(series):
+    """Convierte textos de Entrada/Salida (hora de Lima) a datetimes UTC; lo que no es fecha queda NaT."""
+    local = pd.to_datetime(series.astype(object), format=TIMESTAMP_FORMAT, errors="coerce")
+    return local.dt.tz_localize("America/Lima").dt.tz_convert("UTC")
+
+def backfill_events(dry_run=False):
+    """
+    Completa el historial de eventos en Firestore a partir de los archivos semanales:
+      1. Mueve los eventos de la colección raíz 'eventos' (formato anterior) a la
+         subcolección de cada trabajador.
+      2. Crea los eventos de entrada/salida de las filas consolidadas que no los tienen
+         (semanas anteriores a la bitácora). El historial existente no se modifica.
+    Escribe en lotes de FIRESTORE_BATCH_LIMIT. No toca los totales: después conviene
+    ejecutar rebuild_aggregates. Devuelve la cantidad de eventos escritos.
+    """
+    ops = []
+    storage = get_storage()
+    for path, data in storage.query_documents(EVENTS_COLLECTION):
+        ops.append(("set", event_path(data["Nombre"], data["Fecha"], data["Evento"]), data))
+        ops.append(("delete", path, None))
+    written = len(ops) // 2
+
+    for filename in list_week_files():
+        df = _read_week_blob(filename)
+        if df.empty:
+            continue
+        existing = {(e["Nombre"], e["Fecha"], e["Evento"]) for e in load_week_events(filename)}
+        for key, event in consolidated_events(df, filename).items():
+            if key not in existing:
+                ops.append(("set", event_path(*key), event))
+                written += 1
+
+    if not dry_run:
+        for start in range(0, len(ops), FIRESTORE_BATCH_LIMIT):
+            storage.write_batch(ops[start:start + FIRESTORE_BATCH_LIMIT])
+    return written
+
+# ---------------------------
+# TOTALES MATERIALIZADOS POR TRABAJADOR
+# ---------------------------
+def week_key(filename):
+    """Clave de la semana ISO para los totales: 'registro_2024_W10.xlsx' -> '2024_W10'."""
+    year, week = map(int, _pattern_week.match(filename).groups())
+    return f"{year}_W{week}"
+
+def week_filename_from_key(key):
+    """Archivo semanal de una clave de totales: '2024_W10' -> 'registro_2024_W10.xlsx'."""
+    return f"registro_{key}.xlsx"
+
+def month_week_filenames(year, month):
+    """Archivos semanales de todas las semanas ISO con al menos un día en el mes (existan o no)."""
+    first = date(year, month, 1)
+    last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    days = [first + timedelta(days=d) for d in range(0, (last - first).days + 1, 7)] + [last]
+    return sorted({get_week_filename(day) for day in days})
+
+def month_key(date_str):
+    """Clave del mes para los totales: '2024-03-05' -> '2024-03'."""
+    return date_str[:7]
+
+def aggregate_doc_id(worker, period, key):
+    return f"{worker}_{period}_{key}"
+
+def aggregate_path(worker, period, key):
+    return f"{AGGREGATES_COLLECTION}/{aggregate_doc_id(worker, period, key)}"
+
+def _aggregate_increments(worker, filename, date_str, worked_seconds):
+    """Escrituras (merge) que suman un evento a los totales semanal y mensual del trabajador."""
+    seconds = worked_seconds or 0
+    shifts = 1 if worked_seconds is not None else 0
+    for period, key in (("semana", week_key(filename)), ("mes", month_key(date_str))):
+        yield aggregate_path(worker, period, key), {
+            "Nombre": worker,
+            "Periodo": period,
+            "Clave": key,
+            "Segundos": Increment(seconds),
+            "Turnos": Increment(shifts)
+        }
+
+def _aggregate_seconds(worker, period, key):
+    data = get_storage().get_document(aggregate_path(worker, period, key))
+    return data.get("Segundos", 0) if data is not None else 0
 
 def get_worker_week_hours(worker):
-    """Obtiene la suma de las horas trabajadas en la semana para un trabajador."""
-    filename = get_week_filename()
-    df = load_week_data(filename)
-    records = df[(df["Nombre"] == worker) & (df["Horas Trabajadas"].notna())]
-    total = timedelta()
-    for _, row in records.iterrows():
-        total += parse_timedelta(row["Horas Trabajadas"])
-    return total
+    """Obtiene la suma de las horas trabajadas en la semana para un trabajador (una sola lectura)."""
+    return timedelta(seconds=_aggregate_seconds(worker, "semana", week_key(calendario.week_filename())))
+
+def get_worker_month_hours(worker):
+    """Obtiene la suma de las horas trabajadas en el mes para un trabajador (una sola lectura)."""
+    return timedelta(seconds=_aggregate_seconds(worker, "mes", month_key(calendario.date_str())))
+
+def week_summary_from_aggregates(filename):
+    """Resumen de horas por trabajador de la semana a partir de los totales materializados."""
+    docs = [data for _, data in get_storage().query_documents(
+        AGGREGATES_COLLECTION, [("Periodo", "==", "semana"), ("Clave", "==", week_key(filename))]
+    )]
+    totals = pd.Series(
+        pd.to_timedelta([d.get("Segundos", 0) for d in docs], unit="s"),
+        index=[d["Nombre"] for d in docs],
+        dtype="timedelta64[ns]"
+    )
+    summary_df = pd.DataFrame({
+        "Nombre": totals.index,
+        "Total Horas Trabajadas": format_duration(totals, missing="0:00:00").to_numpy()
+    })
+    return summary_df.sort_values("Nombre")
+
+def rebuild_aggregates(dry_run=False):
+    """
+    Recalcula todos los totales semanales y mensuales a partir de los registros semanales
+    (Parquet/Excel + eventos pendientes) y los compara con los guardados en Firestore.
+    Se recalculan las semanas del catálogo, las marcadas como pendientes y las que aparecen
+    en los totales guardados (aunque todavía no tengan archivo), así un total cuyos eventos
+    existen nunca se borra. Salvo en dry_run, reemplaza los documentos con los valores recalculados.
+    Conviene ejecutarlo fuera del horario de marcación: una marcación concurrente podría
+    quedar contada dos veces o ninguna.
+    Devuelve la lista de diferencias (doc_id, guardado, recalculado) en segundos.
+    """
+    storage = get_storage()
+    stored = {path.rsplit("/", 1)[-1]: data for path, data in storage.query_documents(AGGREGATES_COLLECTION)}
+    # Semanas con eventos que todavía no tienen archivo consolidado: las de los totales guardados
+    weeks = set(list_week_files()) | set(_pending_markers())
+    for data in stored.values():
+        if data.get("Periodo") == "semana":
+            weeks.add(week_filename_from_key(data["Clave"]))
+        elif data.get("Periodo") == "mes":
+            weeks.update(month_week_filenames(*map(int, data["Clave"].split("-"))))
+
+    expected = {}
+    for filename in sorted(weeks):
+        df = load_week_data(filename)
+        if df.empty:
+            continue
+        seconds = hours_to_timedelta(df["Horas Trabajadas"]).dt.total_seconds().fillna(0).astype("int64")
+        shifts = df["Horas Trabajadas"].notna().astype("int64")
+        frame = pd.DataFrame({"Nombre": df["Nombre"], "Mes": df["Fecha"].astype(str).str[:7],
+                              "Segundos": seconds, "Turnos": shifts})
+        for (name,), group in frame.groupby(["Nombre"]):
+            doc_id = aggregate_doc_id(name, "semana", week_key(filename))
+            expected[doc_id] = {"Nombre": name, "Periodo": "semana", "Clave": week_key(filename),
+                                "Segundos": int(group["Segundos"].sum()), "Turnos": int(group["Turnos"].sum())}
+        for (name, month), group in frame.groupby(["Nombre", "Mes"]):
+            doc_id = aggregate_doc_id(name, "mes", month)
+            entry = expected.setdefault(doc_id, {"Nombre": name, "Periodo": "mes", "Clave": month,
+                                                 "Segundos": 0, "Turnos": 0})
+            entry["Segundos"] += int(group["Segundos"].sum())
+            entry["Turnos"] += int(group["Turnos"].sum())
+
+    differences = [
+        (doc_id, stored.get(doc_id, {}).get("Segundos"), data["Segundos"])
+        for doc_id, data in sorted(expected.items())
+        if stored.get(doc_id, {}).get("Segundos") != data["Segundos"]
+    ]
+    differences += [(doc_id, data.get("Segundos"), None) for doc_id, data in sorted(stored.items())
+                    if doc_id not in expected]
+    if dry_run:
+        return differences
+
+    ops = [("set", f"{AGGREGATES_COLLECTION}/{doc_id}", data) for doc_id, data in expected.items()]
+    ops += [("delete", f"{AGGREGATES_COLLECTION}/{doc_id}", None) for doc_id in stored if doc_id not in expected]
+    for start in range(0, len(ops), FIRESTORE_BATCH_LIMIT):
+        storage.write_batch(ops[start:start + FIRESTORE_BATCH_LIMIT])
+    return differences
+
+# ---------------------------
+# REPRESENTACIÓN COMPACTA (HISTÓRICOS GRANDES)
+# ---------------------------
+class Estado(enum.Enum):
+    """Estado de una fila (trabajador y día) en la representación compacta."""
+    COMPLETO = "completo"                # Marcó entrada y salida
+    SIN_SALIDA = "sin_salida"            # "No marcó salida"
+    SIN_ENTRADA = "sin_entrada"          # Salida sin entrada registrada
+    SIN_MARCACIONES = "sin_marcaciones"  # Fila sin entrada ni salida
+
+ESTADO_DTYPE = pd.CategoricalDtype([e.value for e in Estado])
+# Columnas de la representación compacta y sus tipos; EntradaUTC/SalidaUTC en segundos desde la época Unix
+COMPACT_DTYPES = {
+    "Nombre": "category",
+    "Fecha": "date32[pyarrow]",
+    "EntradaUTC": "int64[pyarrow]",
+    "SalidaUTC": "int64[pyarrow]",
+    "Duracion": "duration[s][pyarrow]",
+    "Estado": ESTADO_DTYPE,
+}
+
+def _check_lossless(original, parsed, column):
+    """Falla si algún valor presente en `original` no se pudo convertir."""
+    lost = original.notna().to_numpy() & parsed.isna().to_numpy()
+    if lost.any():
+        value = original[lost].iloc[0]
+        raise ValueError(f"Valor de '{column}' que no se puede representar: {value!r}")
+
+def _parse_column(series, fmt, target, column):
+    """Texto -> `target` (tipo de pyarrow) con pyarrow.compute.strptime; falla si se pierde algún valor."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    parsed = pc.strptime(pa.array(series, type=pa.string(), from_pandas=True), format=fmt, unit="s",
+                         error_is_null=True)
+    if target != pa.date32():
+        # Entrada/Salida están en hora de Lima
+        parsed = pc.assume_timezone(parsed, calendario.LIMA_TZ.zone)
+    result = pd.Series(parsed.cast(target), index=series.index, dtype=pd.ArrowDtype(target))
+    _check_lossless(series, result, column)
+    return result
+
+def _format_column(series, fmt):
+    """Inversa de _parse_column: fechas o segundos UTC -> texto (hora de Lima)."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    values = pa.array(series)
+    if values.type == pa.int64():
+        values = values.cast(pa.timestamp("s", tz=calendario.LIMA_TZ.zone))
+    return pd.Series(pc.strftime(values, format=fmt), index=series.index, dtype="str")
+
+def to_compact(df):
+    """
+    Representación compacta de un DataFrame semanal (el de load_week_data o la hoja 'Registros'):
+    trabajador categórico, fecha date32, entrada y salida en segundos UTC (int64), la duración
+    nula en lugar de "No marcó salida" y el Estado explícito de cada fila.
+    Ocupa una fracción de la memoria de las columnas de texto y vuelve al formato original con
+    from_compact. Una salida vacía se toma como "No marcó salida"; cualquier otro valor que no
+    se pueda representar sin pérdida produce ValueError.
+    """
+    import pyarrow as pa
+
+    entrada = _parse_column(df["Entrada"], TIMESTAMP_FORMAT, pa.int64(), "Entrada")
+    salida = _parse_column(df["Salida"].where(df["Salida"] != NO_EXIT), TIMESTAMP_FORMAT, pa.int64(), "Salida")
+    horas = df["Horas Trabajadas"]
+    duracion = hours_to_timedelta(horas)
+    if not pd.api.types.is_timedelta64_dtype(horas):
+        _check_lossless(horas.where(horas != NO_EXIT), duracion, "Horas Trabajadas")
+    if duracion.dtype != "timedelta64[s]" and (duracion.dt.total_seconds() % 1 > 0).any():
+        raise ValueError("'Horas Trabajadas' con fracciones de segundo no se puede representar.")
+
+    # Códigos de Estado en el orden de ESTADO_DTYPE: 0 completo, 1 sin salida, 2 sin entrada, 3 ninguna
+    has_entry, has_exit = entrada.notna().to_numpy(), salida.notna().to_numpy()
+    codes = np.where(has_entry, np.where(has_exit, 0, 1), np.where(has_exit, 2, 3)).astype("int8")
+    return pd.DataFrame({
+        # Mismo tipo de categorías venga de donde venga la semana (union_categoricals lo exige)
+        "Nombre": pd.Categorical(df["Nombre"].astype("str")),
+        "Fecha": _parse_column(df["Fecha"], "%Y-%m-%d", pa.date32(), "Fecha").array,
+        "EntradaUTC": entrada.array,
+        "SalidaUTC": salida.array,
+        "Duracion": duracion.astype(COMPACT_DTYPES["Duracion"]).array,
+        "Estado": pd.Categorical.from_codes(codes, dtype=ESTADO_DTYPE),
+    })
+
+def from_compact(compact):
+    """Inversa de to_compact: DataFrame semanal con los tipos internos (las horas como duración)."""
+    return pd.DataFrame({
+        "Nombre": compact["Nombre"].astype("str"),
+        "Fecha": _format_column(compact["Fecha"], "%Y-%m-%d"),
+        "Entrada": _format_column(compact["EntradaUTC"], TIMESTAMP_FORMAT),
+        "Salida": _format_column(compact["SalidaUTC"], TIMESTAMP_FORMAT).fillna(NO_EXIT),
+        "Horas Trabajadas": compact["Duracion"].astype("timedelta64[s]"),
+    }, columns=WEEK_COLUMNS)
+
+def concat_compact(frames):
+    """
+    Une DataFrames compactos. pd.concat convierte a texto las categorías que no coinciden,
+    así que primero se lleva 'Nombre' a la unión de las categorías de todos.
+    """
+    frames = list(frames)
+    if not frames:
+        return to_compact(empty_week_df())
+    names = union_categoricals([f["Nombre"] for f in frames], sort_categories=True).categories
+    return pd.concat(
+        [f.assign(Nombre=f["Nombre"].cat.set_categories(names)) for f in frames], ignore_index=True
+    )
+
+def load_compact_weeks(week_files, max_workers=MONTHLY_FETCH_WORKERS):
+    """
+    Carga varias semanas en paralelo y las une en la representación compacta, en el orden dado.
+    Cada semana se convierte apenas se lee y no queda en la caché de semanas, así nunca se
+    tienen todas en formato de texto a la vez.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return concat_compact(executor.map(lambda f: to_compact(load_week_data(f, cache=False)), week_files))
 
 # ---------------------------
 # NUEVA FUNCIÓN: GENERAR ARCHIVO MENSUAL
 # ---------------------------
+def _month_records_from_week(filename, selected_year, selected_month):
+    """Carga una semana y devuelve solo sus registros del mes y año dados."""
+    df_week = load_week_data(filename)
+    if df_week.empty:
+        return df_week
+    fechas = pd.to_datetime(df_week["Fecha"], format="%Y-%m-%d", errors="coerce")
+    mask = (fechas.dt.year == selected_year) & (fechas.dt.month == selected_month)
+    return df_week.loc[mask]
+
+def collect_month_records(selected_year, selected_month, max_workers=MONTHLY_FETCH_WORKERS):
+    """
+    Reúne los registros del mes leyendo solo las semanas ISO que se superponen con él.
+    Las semanas se descargan y leen en paralelo (como máximo max_workers a la vez);
+    si una falla, se reporta y se sigue con las demás.
+    Devuelve (DataFrame del mes o None si no hay registros, lista de (archivo, error)).
+    """
+    week_files = month_week_files(selected_year, selected_month)
+    monthly_dfs = {}
+    errors = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(_month_records_from_week, filename, selected_year, selected_month): filename
+            for filename in week_files
+        }
+        for future in as_completed(futures):
+            filename = futures[future]
+            try:
+                df_filtered = future.result()
+            except Exception as e:
+                errors.append((filename, e))
+                continue
+            if not df_filtered.empty:
+                monthly_dfs[filename] = df_filtered
+
+    if not monthly_dfs:
+        return None, errors
+    # Orden estable por semana, independiente del orden en que terminaron las descargas
+    ordered = [monthly_dfs[f] for f in week_files if f in monthly_dfs]
+    return pd.concat(ordered, ignore_index=True), errors
+
+@timed("reporte_mensual")
 def generate_monthly_file(selected_year, selected_month):
     """
-    Reúne todos los registros de los archivos semanales almacenados en Firebase Storage correspondientes
-    al mes y año seleccionados. Filtra los registros en base a la columna "Fecha" (formato YYYY-MM-DD).
+    Reúne los registros de los archivos semanales almacenados en Firebase Storage correspondientes
+    al mes y año seleccionados (solo las semanas que se superponen con el mes, leídas en paralelo).
+    Filtra los registros en base a la columna "Fecha" (formato YYYY-MM-DD).
     Genera un archivo Excel con dos hojas: "Registros" y "Resumen", manteniendo el estilo y formato.
     Retorna el contenido binario del archivo.
     """
-    blobs = list(bucket.list_blobs(prefix="registro_"))  # lista de blobs
-    monthly_dfs = []
-    for blob in blobs:
-        try:
-            data = blob.download_as_bytes()
-            df_week = pd.read_excel(io.BytesIO(data), sheet_name='Registros')
-            if not df_week.empty:
-                df_week["Fecha_dt"] = pd.to_datetime(df_week["Fecha"], format="%Y-%m-%d", errors="coerce")
-                mask = (df_week["Fecha_dt"].dt.year == selected_year) & (df_week["Fecha_dt"].dt.month == selected_month)
-                df_filtered = df_week.loc[mask].drop(columns=["Fecha_dt"])
-                if not df_filtered.empty:
-                    monthly_dfs.append(df_filtered)
-        except Exception as e:
-            st.error(f"Error procesando el archivo {blob.name}: {e}")
+    df_month, errors = collect_month_records(selected_year, selected_month)
+    for filename, e in errors:
+        st.error(f"Error procesando el archivo {filename}: {e}")
     
-    if not monthly_dfs:
+    if df_month is None:
         st.error("No se encontraron registros para el mes y año seleccionados.")
         return None
 
-    df_month = pd.concat(monthly_dfs, ignore_index=True)
-    resumen_month = create_summary_df(df_month)
-    
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df_month.to_excel(writer, sheet_name='Registros', index=False)
-        ws = writer.sheets['Registros']
-        for col_cells in ws.columns:
-            max_length = 0
-            col_letter = col_cells[0].column_letter
-            for cell in col_cells:
-                if cell.value:
-                    cell_length = len(str(cell.value))
-                    if cell_length > max_length:
-                        max_length = cell_length
-            ws.column_dimensions[col_letter].width = max_length + 2
-
-        resumen_month.to_excel(writer, sheet_name='Resumen', index=False)
-        ws_resumen = writer.sheets['Resumen']
-        for col_cells in ws_resumen.columns:
-            max_length = 0
-            col_letter = col_cells[0].column_letter
-            for cell in col_cells:
-                if cell.value:
-                    cell_length = len(str(cell.value))
-                    if cell_length > max_length:
-                        max_length = cell_length
-            ws_resumen.column_dimensions[col_letter].width = max_length + 2
-
-        thin_border = Border(
-            left=Side(style="thin"),
-            right=Side(style="thin"),
-            top=Side(style="thin"),
-            bottom=Side(style="thin")
-        )
-        for ws_sheet in [ws, ws_resumen]:
-            for row in ws_sheet.iter_rows():
-                for cell in row:
-                    cell.border = thin_border
+    return monthly_workbook(df_month)
 
-    output.seek(0)
-    return output
+def monthly_workbook(df_month):
+    """Excel del mes con las hojas "Registros" y "Resumen"."""
+    return render_workbook({
+        "Registros": to_sheet_layout(df_month),
+        "Resumen": create_summary_df(df_month)
+    })
 
 # ---------------------------
 # NUEVAS FUNCIONES AUXILIARES PARA DESCARGAS ----------------
 _pattern_week = re.compile(r"registro_(\d{4})_W(\d{1,2})\.xlsx")
+_pattern_week_blob = re.compile(r"registro_(\d{4})_W(\d{1,2})\.(xlsx|parquet)$")
+
+def catalog_entry(filename, blob, rows):
+    """Datos de un archivo semanal en el catálogo: semana ISO, rango de fechas, generación, tamaño y filas."""
+    year, week = map(int, _pattern_week.match(filename).groups())
+    monday = datetime.fromisocalendar(year, week, 1)
+    return {
+        "Archivo": filename,
+        "Anio": year,
+        "Semana": week,
+        "Desde": monday.strftime("%Y-%m-%d"),
+        "Hasta": (monday + timedelta(days=6)).strftime("%Y-%m-%d"),
+        "Blob": blob.name,
+        "Generacion": blob.generation,
+        "Bytes": blob.size,
+        "Filas": rows
+    }
+
+def update_catalog(filename, blob, rows):
+    """
+    Registra (merge) la versión recién escrita de una semana en el catálogo. Cada semana es un
+    campo propio del documento, así las escrituras de semanas distintas no se pisan; si dos
+    escrituras de la misma semana se cruzan, la entrada puede quedar con la generación anterior,
+    pero el catálogo solo se usa para listar: las lecturas siempre consultan la generación real.
+    """
+    get_storage().set_document(CATALOG_PATH, {"semanas": {week_key(filename): catalog_entry(filename, blob, rows)}}, merge=True)
+
+def rebuild_catalog():
+    """
+    Reconstruye el catálogo listando el bucket una sola vez (registro_*.parquet y los .xlsx
+    originales que todavía no se migraron). Las filas se cuentan desde los metadatos del
+    Parquet, leyendo solo el pie del archivo (open_blob por bloques chicos, sin descargarlo
+    entero); para los .xlsx sin migrar (o un Parquet ilegible) quedan en None.
+    Devuelve las entradas por semana.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    storage = get_storage()
+    blobs = {}
+    for b in storage.list_blobs(prefix="registro_"):
+        match = _pattern_week_blob.match(b.name)
+        if match:
+            filename = f"registro_{match.group(1)}_W{match.group(2)}.xlsx"
+            # La copia Parquet, si existe, es la fuente de verdad de la semana
+            if match.group(3) == "parquet" or filename not in blobs:
+                blobs[filename] = b
+    entries = {}
+    for filename, blob in blobs.items():
+        rows = None
+        if blob.name.endswith(".parquet"):
+            with storage.open_blob(blob.name, chunk_size=PARQUET_FOOTER_CHUNK_SIZE) as f:
+                try:
+                    rows = pq.ParquetFile(f).metadata.num_rows
+                except pa.ArrowException:
+                    pass
+        entries[week_key(filename)] = catalog_entry(filename, blob, rows)
+    storage.set_document(CATALOG_PATH, {"Completo": True, "semanas": entries})
+    return entries
+
+def load_catalog():
+    """
+    Entradas del catálogo por semana, con una sola lectura. Si el catálogo todavía no se armó
+    desde el bucket (primera vez, o solo tiene las semanas escritas desde entonces), se reconstruye.
+    """
+    catalog = get_storage().get_document(CATALOG_PATH)
+    if catalog is None or not catalog.get("Completo"):
+        return rebuild_catalog()
+    return catalog.get("semanas", {})
 
 def list_week_files() -> list[str]:
-    """Devuelve los blobs con patrón registro_YYYY_Www.xlsx (solo semanas)."""
-    return sorted(
-        [b.name for b in bucket.list_blobs(prefix="registro_") if _pattern_week.match(b.name)]
-    )
+    """
+    Devuelve los archivos semanales registro_YYYY_Www.xlsx disponibles, ya sea que existan
+    como Excel original o solo como copia Parquet (el Excel se genera al descargar).
+    Se leen del catálogo (un solo documento), sin listar el bucket.
+    """
+    return sorted(entry["Archivo"] for entry in load_catalog().values())
 
-def week_files_for_month(year: int, month: int, all_files: list[str]) -> list[str]:
-    """Filtra las semanas cuyo primer día ISO-week cae en el mes/año dados."""
-    target = []
-    for fname in all_files:
-        year_w, week = map(int, _pattern_week.match(fname).groups())
-        first_day = datetime.fromisocalendar(year_w, week, 1)
-        if first_day.year == year and first_day.month == month:
-            target.append(fname)
-    return target
-
-def zip_blobs(blob_names: list[str]) -> io.BytesIO:
-    """Crea un ZIP en memoria con los blobs dados y lo devuelve."""
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
-        for name in blob_names:
-            data = bucket.blob(name).download_as_bytes()
-            zf.writestr(name, data)
+def month_week_files(year: int, month: int) -> list[str]:
+    """
+    Semanas del catálogo cuyo rango de fechas se superpone con el mes dado, en orden cronológico
+    (incluye las semanas que empiezan en el mes anterior o terminan en el siguiente).
+    """
+    return [e["Archivo"] for e in _month_catalog_entries(load_catalog(), year, month)]
+
+def _month_catalog_entries(catalog, year, month):
+    """Entradas del catálogo que se superponen con el mes, en orden cronológico."""
+    # Las fechas 'YYYY-MM-DD' se comparan como texto; el día 31 cubre cualquier fin de mes
+    first = f"{year:04d}-{month:02d}-01"
+    last = f"{year:04d}-{month:02d}-31"
+    entries = [e for e in catalog.values() if e["Desde"] <= last and e["Hasta"] >= first]
+    return sorted(entries, key=lambda e: (e["Anio"], e["Semana"]))
+
+def _open_zip_member(name):
+    """
+    Abre el contenido de un miembro del ZIP como archivo de lectura.
+    Si la semana todavía no tiene copia Parquet, el Excel original es la fuente y se lee
+    por bloques directamente desde Storage; si no, se genera el Excel al vuelo. Las semanas
+    no se guardan en la caché del proceso: un ZIP del histórico la llenaría con todo.
+    """
+    storage = get_storage()
+    if not storage.blob_exists(parquet_name(name)) and storage.blob_exists(name):
+        return storage.open_blob(name, chunk_size=ZIP_CHUNK_SIZE)
+    return io.BytesIO(week_excel_bytes(name, cache=False))
+
+@timed("zip")
+def write_zip(blob_names, dest, prefetch=ZIP_PREFETCH):
+    """
+    Escribe en `dest` (archivo binario) un ZIP con el Excel de cada semana dada.
+    Prepara hasta `prefetch` semanas a la vez en segundo plano mientras se escribe la actual,
+    así la memoria queda acotada a unas pocas semanas sin importar el tamaño del histórico.
+    Los .xlsx ya vienen comprimidos (son ZIP), por eso se guardan sin volver a comprimir.
+    """
+    names = iter(blob_names)
+    with ThreadPoolExecutor(max_workers=prefetch) as executor, \
+            zipfile.ZipFile(dest, "w", zipfile.ZIP_DEFLATED) as zf:
+        pending = deque(
+            (name, executor.submit(_open_zip_member, name)) for name in itertools.islice(names, prefetch)
+        )
+        while pending:
+            name, future = pending.popleft()
+            next_name = next(names, None)
+            if next_name is not None:
+                pending.append((next_name, executor.submit(_open_zip_member, next_name)))
+            compress = zipfile.ZIP_STORED if name.endswith(".xlsx") else zipfile.ZIP_DEFLATED
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            info.compress_type = compress
+            with future.result() as src, zf.open(info, "w") as member:
+                shutil.copyfileobj(src, member, ZIP_CHUNK_SIZE)
+
+def zip_blobs(blob_names: list[str]):
+    """
+    Crea un ZIP con el Excel de cada semana dada y lo devuelve posicionado al inicio.
+    Se arma en un archivo temporal que se mantiene en memoria mientras es chico y pasa
+    a disco al superar ZIP_SPOOL_MAX_BYTES.
+    """
+    buf = tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_MAX_BYTES)
+    write_zip(blob_names, buf)
     buf.seek(0)
     return buf
 
+# ---------------------------
+# EXPORTACIONES EN CACHÉ (REPORTE MENSUAL Y ZIP)
+# ---------------------------
+logger = logging.getLogger("registros.exportaciones")
+
+_pattern_export = re.compile(r"registros?_(\d{4})_(\d{2})\.(xlsx|zip)")
+
+def export_filename(kind, year=None, month=None):
+    """Nombre de descarga de la exportación: 'registro_2024_03.xlsx', 'registros_2024_03.zip', 'registros_all.zip'."""
+    return EXPORT_KINDS[kind][0].format(year=year, month=month)
+
+def export_blob_name(kind, year=None, month=None):
+    return EXPORTS_PREFIX + export_filename(kind, year, month)
+
+def parse_export_blob_name(name):
+    """Inversa de export_blob_name: (tipo, año, mes), o None si el blob no es una exportación."""
+    filename = name[len(EXPORTS_PREFIX):]
+    if filename == export_filename("zip_todo"):
+        return "zip_todo", None, None
+    match = _pattern_export.fullmatch(filename)
+    if match is None:
+        return None
+    kind = "mensual" if match.group(3) == "xlsx" else "zip_mes"
+    return kind, int(match.group(1)), int(match.group(2))
+
+def export_sources(kind, year=None, month=None):
+    """
+    Semanas de las que depende la exportación y su firma: un hash del blob y la generación de
+    cada una según el catálogo. Si alguna semana se reescribe, la firma cambia.
+    Devuelve (archivos semanales, firma).
+    """
+    catalog = load_catalog()
+    if kind == "zip_todo":
+        entries = sorted(catalog.values(), key=lambda e: (e["Anio"], e["Semana"]))
+    else:
+        entries = _month_catalog_entries(catalog, year, month)
+    return [e["Archivo"] for e in entries], _sources_signature(entries)
+
+def _sources_signature(entries):
+    """Hash del blob y la generación de cada semana del catálogo dada."""
+    return hashlib.sha256(
+        ";".join(f"{e['Blob']}:{e['Generacion']}" for e in entries).encode("utf-8")
+    ).hexdigest()
+
+def _write_export(kind, year, month, week_files, dest):
+    """Genera la exportación en `dest`. Devuelve False si no hay registros para exportar."""
+    if kind != "mensual":
+        write_zip(week_files, dest)
+        return True
+    df_month, errors = collect_month_records(year, month)
+    if errors:
+        # Un reporte al que le falta una semana no se guarda como vigente
+        filename, error = errors[0]
+        raise RuntimeError(f"Error procesando el archivo {filename}: {error}") from error
+    if df_month is None:
+        return False
+    dest.write(monthly_workbook(df_month).getvalue())
+    return True
+
+@timed("exportacion")
+def refresh_export(kind, year=None, month=None, force=False):
+    """
+    Regenera la exportación guardada si sus semanas de origen cambiaron desde que se generó
+    (o siempre, con force). La firma de las semanas queda en los metadatos del blob; un mes
+    sin registros se guarda como archivo vacío marcado "vacio", para no regenerarlo en cada pedido.
+    Devuelve el BlobInfo vigente.
+    """
+    storage = get_storage()
+    name = export_blob_name(kind, year, month)
+    week_files, signature = export_sources(kind, year, month)
+    current = storage.get_blob(name)
+    if not force and current is not None and current.metadata.get("fuentes") == signature:
+        return current
+    metadata = {"fuentes": signature, "semanas": str(len(week_files))}
+    with tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_MAX_BYTES) as buf:
+        if not week_files or not _write_export(kind, year, month, week_files, buf):
+            metadata["vacio"] = "1"
+        buf.seek(0)
+        return storage.put_blob_file(name, buf, content_type=EXPORT_KINDS[kind][1], metadata=metadata)
+
+@st.cache_resource
+def _export_jobs():
+    """Hilo de fondo y trabajos en curso, compartidos por todas las sesiones del servidor."""
+    return {
+        "executor": ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="exportaciones"),
+        "pending": {},
+        "lock": threading.Lock()
+    }
+
+def schedule_export_refresh(kind, year=None, month=None):
+    """
+    Encola refresh_export en segundo plano, salvo que ya haya una regeneración de la misma
+    exportación encolada o en curso. Devuelve su Future.
+    """
+    jobs = _export_jobs()
+    name = export_blob_name(kind, year, month)
+    with jobs["lock"]:
+        future = jobs["pending"].get(name)
+        if future is None or future.done():
+            future = jobs["executor"].submit(refresh_export, kind, year, month)
+            future.add_done_callback(lambda f: _log_export_failure(name, f))
+            jobs["pending"][name] = future
+        return future
+
+def _log_export_failure(name, future):
+    if future.exception() is not None:
+        logger.error("No se pudo generar %s", name, exc_info=future.exception())
+
+def _take_failed_export(name):
+    """Si la última regeneración en segundo plano de `name` falló, la descarta y devuelve el error."""
+    jobs = _export_jobs()
+    with jobs["lock"]:
+        future = jobs["pending"].get(name)
+        if future is None or not future.done() or future.exception() is None:
+            return None
+        del jobs["pending"][name]
+        return future.exception()
+
+def request_export(kind, year=None, month=None):
+    """
+    Exportación lista para descargar, sin generarla dentro del pedido. Devuelve (datos, estado):
+      - (bytes, "vigente"): el archivo guardado corresponde a las semanas actuales.
+      - (bytes, "actualizando"): versión anterior; la nueva se está generando en segundo plano.
+      - (None, "generando"): todavía no existe; se está generando en segundo plano.
+      - (None, "vacio"): no hay registros para exportar.
+      - (datos o None, "error"): falló la última generación; el próximo pedido la reintenta.
+    Los meses cerrados no cambian, así que se sirven siempre desde el archivo guardado.
+    """
+    storage = get_storage()
+    name = export_blob_name(kind, year, month)
+    week_files, signature = export_sources(kind, year, month)
+    if not week_files:
+        return None, "vacio"
+    blob = storage.get_blob(name)
+    if blob is not None and blob.metadata.get("fuentes") == signature:
+        if blob.metadata.get("vacio"):
+            return None, "vacio"
+        return storage.read_blob(name), "vigente"
+
+    failed = _take_failed_export(name)
+    if failed is None:
+        schedule_export_refresh(kind, year, month)
+    stale = storage.read_blob(name) if blob is not None and not blob.metadata.get("vacio") else None
+    if failed is not None:
+        return stale, "error"
+    return stale, "actualizando" if stale is not None else "generando"
+
+def stored_exports():
+    """Exportaciones guardadas en Storage, como (tipo, año, mes)."""
+    parsed = (parse_export_blob_name(b.name) for b in get_storage().list_blobs(prefix=EXPORTS_PREFIX))
+    return [export for export in parsed if export is not None]
+
+def schedule_stale_exports():
+    """Encola la revisión de todas las exportaciones guardadas (solo se regeneran las desactualizadas)."""
+    for kind, year, month in stored_exports():
+        schedule_export_refresh(kind, year, month)
+
+# ---------------------------
+# ANALÍTICA DEL HISTÓRICO (RANGOS DE FECHAS)
+# ---------------------------
+def _months_between(start, end):
+    """(año, mes) de cada mes entre las fechas dadas, ambos inclusive."""
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        yield year, month
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+def analytics_partition_name(year, month):
+    return f"{ANALYTICS_PREFIX}mes={year:04d}-{month:02d}.parquet"
+
+def build_analytics_partition(year, month, entries):
+    """
+    Escribe la partición del mes: las filas compactas (to_compact) con Fecha en el mes, tomadas
+    de las semanas del catálogo dadas (`entries`) y ordenadas por Fecha y Nombre. En los
+    metadatos queda la firma de esas semanas, para saber cuándo hay que regenerarla.
+    Devuelve el DataFrame compacto de la partición.
+    """
+    first = date(year, month, 1)
+    following = date(year + month // 12, month % 12 + 1, 1)
+    compact = load_compact_weeks([e["Archivo"] for e in entries])
+    in_month = ((compact["Fecha"] >= first) & (compact["Fecha"] < following)).to_numpy()
+    partition = compact[in_month].sort_values(["Fecha", "Nombre"], ignore_index=True)
+    partition["Nombre"] = partition["Nombre"].cat.remove_unused_categories()
+
+    name = analytics_partition_name(year, month)
+    buf = io.BytesIO()
+    with span("parquet.escribir", blob=name) as s:
+        partition.to_parquet(buf, index=False, row_group_size=ANALYTICS_ROW_GROUP_SIZE)
+        s.add_bytes(buf.tell())
+    blob = get_storage().put_blob(name, buf.getvalue(), content_type=PARQUET_MIME, metadata={
+        "fuentes": _sources_signature(entries),
+        "filas": str(len(partition))
+    })
+    _put_cached_week(blob.name, blob.generation, partition)
+    return partition
+
+def _read_analytics_partition(blob):
+    """Partición vigente: desde la caché del proceso si es la misma generación, si no se descarga."""
+    cached = _get_cached_week(blob.name, blob.generation)
+    if cached is None:
+        data = get_storage().read_blob(blob.name, if_generation_match=blob.generation)
+        with span("parquet.leer", blob=blob.name) as s:
+            s.add_bytes(len(data))
+            cached = pd.read_parquet(io.BytesIO(data)).astype({"Estado": ESTADO_DTYPE})
+        _put_cached_week(blob.name, blob.generation, cached)
+    return cached
+
+def _analytics_partitions(months, rebuild_all=False):
+    """
+    Particiones de los meses dados (solo los que tienen semanas en el catálogo), en orden.
+    Con una lectura del catálogo y un listado de analitica/ se sabe cuáles están vigentes;
+    las que faltan o cuyas semanas cambiaron (o todas, con rebuild_all) se regeneran.
+    """
+    catalog = load_catalog()
+    stored = {b.name: b for b in get_storage().list_blobs(prefix=ANALYTICS_PREFIX)}
+
+    def load(year_month):
+        entries = _month_catalog_entries(catalog, *year_month)
+        if not entries:
+            return None
+        blob = stored.get(analytics_partition_name(*year_month))
+        if not rebuild_all and blob is not None and blob.metadata.get("fuentes") == _sources_signature(entries):
+            try:
+                return _read_analytics_partition(blob)
+            except PreconditionFailed:
+                pass  # Se regeneró mientras tanto; se vuelve a armar con las semanas actuales
+        return build_analytics_partition(*year_month, entries)
+
+    with ThreadPoolExecutor(max_workers=MONTHLY_FETCH_WORKERS) as executor:
+        return [p for p in executor.map(load, months) if p is not None]
+
+@timed("analitica")
+def query_records(start, end, workers=None):
+    """
+    Registros compactos (ver to_compact) con Fecha entre start y end (datetime.date, ambos
+    inclusive), de todos los trabajadores o solo de los de `workers`.
+    El histórico está particionado por mes en analitica/: solo se leen las particiones del
+    rango, y las filas de los meses de los extremos se filtran después.
+    """
+    records = concat_compact(_analytics_partitions(list(_months_between(start, end))))
+    mask = (records["Fecha"] >= start) & (records["Fecha"] <= end)
+    if workers:
+        mask &= records["Nombre"].isin(workers)
+    return records[mask.to_numpy()].reset_index(drop=True)
+
+def rebuild_analytics(force=False):
+    """
+    Arma (o, con force, rearma) las particiones de todos los meses del catálogo que no están
+    vigentes, así las consultas no tienen que hacerlo. Devuelve la cantidad de filas por mes.
+    """
+    entries = load_catalog().values()
+    if not entries:
+        return {}
+    start = min(date.fromisoformat(e["Desde"]) for e in entries)
+    end = max(date.fromisoformat(e["Hasta"]) for e in entries)
+    partitions = _analytics_partitions(list(_months_between(start, end)), rebuild_all=force)
+    return {f"{p['Fecha'].iloc[0]:%Y-%m}": len(p) for p in partitions if not p.empty}
+
+def late_arrivals_mask(records, late_hour=ENTRY_DEADLINE):
+    """Filas cuya entrada (hora de Lima) es a las `late_hour` o después."""
+    entry = pd.to_datetime(records["EntradaUTC"], unit="s", utc=True).dt.tz_convert(calendario.LIMA_TZ)
+    return (entry.dt.hour >= late_hour).fillna(False).to_numpy(dtype=bool)
+
+def worker_analytics(records, late_hour=ENTRY_DEADLINE):
+    """
+    Resumen por trabajador de registros compactos: días con entrada, horas trabajadas,
+    tardanzas (entradas a partir de las `late_hour`, hora de Lima) y turnos sin salida.
+    """
+    frame = pd.DataFrame({
+        "Nombre": records["Nombre"],
+        "Días": records["EntradaUTC"].notna().to_numpy(),
+        "Horas Trabajadas": records["Duracion"].astype("timedelta64[s]"),
+        "Tardanzas": late_arrivals_mask(records, late_hour),
+        "Sin salida": (records["Estado"] == Estado.SIN_SALIDA.value).to_numpy(),
+    })
+    summary = frame.groupby("Nombre", observed=True).sum()
+    return summary.reset_index()
+
+# ---------------------------
+# TIEMPOS POR ETAPA (PANEL DE ADMINISTRACIÓN)
+# ---------------------------
+def stage_timings_df():
+    """Resumen de las etapas medidas en este proceso (ver metricas.py), con percentiles recientes."""
+    rows = []
+    for name, stage in snapshot().items():
+        recent = pd.Series(stage["recientes"], dtype="float64") * 1000
+        rows.append({
+            "Etapa": name,
+            "Llamadas": stage["llamadas"],
+            "Errores": stage["errores"],
+            "p50 (ms)": round(recent.quantile(0.5), 2),
+            "p95 (ms)": round(recent.quantile(0.95), 2),
+            "Máx (ms)": round(recent.max(), 2),
+            "MB": round(stage["bytes"] / 1e6, 2)
+        })
+    return pd.DataFrame(rows, columns=["Etapa", "Llamadas", "Errores", "p50 (ms)", "p95 (ms)", "Máx (ms)", "MB"])
+
+def stage_histogram_df(name):
+    """Histograma de las duraciones recientes de una etapa, con los buckets de metricas.BUCKETS."""
+    recent = pd.Series(snapshot().get(name, {}).get("recientes", []), dtype="float64")
+    labels = [f"≤ {upper * 1000:g} ms" for upper in BUCKETS[:-1]] + [f"> {BUCKETS[-2] * 1000:g} ms"]
+    counts = pd.cut(recent, bins=(0.0,) + BUCKETS, labels=labels, include_lowest=True).value_counts(sort=False)
+    return pd.DataFrame({"Duración": labels, "Llamadas": counts.reindex(labels, fill_value=0).to_numpy()})
+
 # ---------------------------
 # INTERFAZ DE USUARIO CON STREAMLIT
 # ---------------------------
 
 user_list = ["Nelida Ruiz", "Ricardo Adrian Ruiz", "Paula Lecaros"]
-user_passwords = st.secrets["user_passwords"]
 
-st.title("Registro de Entradas y Salidas (CLOUD: Firestore + Firebase Storage)")
+def show_export(kind, year=None, month=None, empty_message="", label=None):
+    """Botón de descarga de una exportación en caché o, si se está generando, el aviso correspondiente."""
+    data, status = request_export(kind, year, month)
+    filename = export_filename(kind, year, month)
+    if status == "vacio":
+        st.warning(empty_message)
+    elif status == "generando":
+        st.info("El archivo se está generando en segundo plano. Vuelva a presionar el botón en unos segundos.")
+    elif status == "actualizando":
+        st.info("Hubo cambios desde la última versión; la nueva se está generando en segundo plano. "
+                "Mientras tanto puede descargar la versión anterior.")
+    elif status == "error":
+        st.error("No se pudo generar el archivo (ver el log del servidor). Vuelva a presionar el botón para reintentar.")
+    if data is not None:
+        st.download_button(
+            label=label or f"Descargar {filename}",
+            data=data,
+            file_name=filename,
+            mime=EXPORT_KINDS[kind][1]
+        )
+
+def main():
+    user_passwords = st.secrets["user_passwords"]
+
+    st.title("Registro de Entradas y Salidas (CLOUD: Firestore + Firebase Storage)")
 
-with st.expander("Selecciona al Trabajador"):
-    worker = st.selectbox("Elige tu nombre:", [""] + user_list)
+    with st.expander("Selecciona al Trabajador"):
+        worker = st.selectbox("Elige tu nombre:", [""] + user_list)
 
-if worker:
-    password_input = st.text_input("Ingrese su contraseña:", type="password")
+    if worker:
+        password_input = st.text_input("Ingrese su contraseña:", type="password")
     
-    if password_input:
-        if password_input == user_passwords.get(worker, ""):
-            if worker == "Ricardo Adrian Ruiz":
-                st.info("Bienvenido, ADMIN.")
-            else:
-                st.info(f"Bienvenido, {worker}.")
+        if password_input:
+            if password_input == user_passwords.get(worker, ""):
+                if worker == "Ricardo Adrian Ruiz":
+                    st.info("Bienvenido, ADMIN.")
+                else:
+                    st.info(f"Bienvenido, {worker}.")
             
-            st.header(f"Registro para: {worker}")
+                st.header(f"Registro para: {worker}")
             
-            col1, col2 = st.columns(2)
-            with col1:
-                if st.button("Registrar Entrada"):
-                    success, msg = register_event(worker, "entrada")
-                    if success:
-                        st.success(msg)
-                    else:
-                        st.warning(msg)
-            with col2:
-                if st.button("Registrar Salida"):
-                    success, msg = register_event(worker, "salida")
-                    if success:
-                        st.success(msg)
-                    else:
-                        st.warning(msg)
+                col1, col2 = st.columns(2)
+                with col1:
+                    if st.button("Registrar Entrada"):
+                        success, msg = register_event(worker, "entrada")
+                        if success:
+                            st.success(msg)
+                        else:
+                            st.warning(msg)
+                with col2:
+                    if st.button("Registrar Salida"):
+                        success, msg = register_event(worker, "salida")
+                        if success:
+                            st.success(msg)
+                        else:
+                            st.warning(msg)
             
-            total_hours = get_worker_week_hours(worker)
-            st.write("Total de horas trabajadas esta semana:", str(total_hours))
+                total_hours = get_worker_week_hours(worker)
+                st.write("Total de horas trabajadas esta semana:", str(total_hours))
+                st.write("Total de horas trabajadas este mes:", str(get_worker_month_hours(worker)))
             
-            if worker == "Ricardo Adrian Ruiz":
-                st.subheader("Resumen Semanal General")
-                if st.button("Mostrar resumen de horas por trabajador"):
-                    filename = get_week_filename()
-                    df = load_week_data(filename)
-                    resumen = create_summary_df(df)
-                    st.dataframe(resumen)
-            else:
-                if st.button("Mostrar mis registros semanales"):
-                    filename = get_week_filename()
-                    df = load_week_data(filename)
-                    worker_records = df[df["Nombre"] == worker]
-                    st.dataframe(worker_records)
+                if worker == "Ricardo Adrian Ruiz":
+                    st.subheader("Resumen Semanal General")
+                    if st.button("Mostrar resumen de horas por trabajador"):
+                        resumen = week_summary_from_aggregates(calendario.week_filename())
+                        st.dataframe(resumen)
+                else:
+                    if st.button("Mostrar mis registros semanales"):
+                        today = calendario.now_lima().date()
+                        monday = today - timedelta(days=today.weekday())
+                        worker_records = get_worker_records(
+                            worker, monday.isoformat(), (monday + timedelta(days=6)).isoformat()
+                        )
+                        st.dataframe(to_sheet_layout(worker_records))
+                    if st.button("Mostrar mis registros del mes"):
+                        month_prefix = calendario.now_lima().strftime("%Y-%m")
+                        worker_records = get_worker_records(worker, f"{month_prefix}-01", f"{month_prefix}-31")
+                        st.dataframe(to_sheet_layout(worker_records))
             
-            # --- Sección ADMIN: Descarga de registros semanales ---------------
-            if worker == "Ricardo Adrian Ruiz":
-                st.markdown("---")
-                st.subheader("Descarga de registros semanales")
+                # --- Sección ADMIN: Descarga de registros semanales ---------------
+                if worker == "Ricardo Adrian Ruiz":
+                    st.markdown("---")
+                    st.subheader("Descarga de registros semanales")
 
-                # Valores de año y mes para filtros y descargas
-                current_year = datetime.now().year
-                selected_year = st.session_state.get("selected_year", current_year)
-                selected_month = st.session_state.get("selected_month_num", datetime.now().month)
+                    # Valores de año y mes para filtros y descargas
+                    current_year = calendario.now_lima().year
+                    selected_year = st.session_state.get("selected_year", current_year)
+                    selected_month = st.session_state.get("selected_month_num", calendario.now_lima().month)
 
-                week_files = list_week_files()
+                    # Consolidar en los archivos semanales los eventos aún pendientes; si alguna
+                    # semana cambió, las exportaciones guardadas se regeneran en segundo plano
+                    if compact_pending_weeks():
+                        schedule_stale_exports()
+                    week_files = list_week_files()
 
-                if not week_files:
-                    st.info("No hay archivos semanales en Firebase Storage.")
-                else:
-                    selected_file = st.selectbox(
-                        "Selecciona un archivo semanal para descargar:", [""] + week_files
-                    )
+                    if not week_files:
+                        st.info("No hay archivos semanales en Firebase Storage.")
+                    else:
+                        selected_file = st.selectbox(
+                            "Selecciona un archivo semanal para descargar:", [""] + week_files
+                        )
 
-                    col_dl_one, col_dl_month, col_dl_all = st.columns(3)
-
-                    # Descargar archivo individual
-                    with col_dl_one:
-                        if selected_file:
-                            data = bucket.blob(selected_file).download_as_bytes()
-                            st.download_button(
-                                label=f"Descargar {selected_file}",
-                                data=data,
-                                file_name=selected_file,
-                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                            )
-
-                    # ZIP del mes seleccionado (usa año/mes elegidos arriba)
-                    with col_dl_month:
-                        if st.button("ZIP del mes seleccionado"):
-                            month_weeks = week_files_for_month(
-                                selected_year, selected_month, week_files
-                            )
-                            if month_weeks:
-                                buf = zip_blobs(month_weeks)
-                                zip_name = f"registros_{selected_year}_{selected_month:02d}.zip"
+                        col_dl_one, col_dl_month, col_dl_all = st.columns(3)
+
+                        # Descargar archivo individual
+                        with col_dl_one:
+                            if selected_file:
+                                # El Excel se arma recién al presionar el botón, no en cada recarga
                                 st.download_button(
-                                    label=f"Descargar {zip_name}",
-                                    data=buf,
-                                    file_name=zip_name,
-                                    mime="application/zip"
+                                    label=f"Descargar {selected_file}",
+                                    data=lambda: week_excel_bytes(selected_file),
+                                    file_name=selected_file,
+                                    mime=EXCEL_MIME
                                 )
-                            else:
-                                st.warning("No hay semanas para ese mes.")
-
-                    # ZIP con todo el histórico
-                    with col_dl_all:
-                        if st.button("ZIP con TODO"):
-                            buf = zip_blobs(week_files)
-                            st.download_button(
-                                label="Descargar registros_all.zip",
-                                data=buf,
-                                file_name="registros_all.zip",
-                                mime="application/zip"
-                            )
+
+                        # ZIP del mes seleccionado (usa año/mes elegidos arriba)
+                        with col_dl_month:
+                            if st.button("ZIP del mes seleccionado"):
+                                show_export("zip_mes", selected_year, selected_month,
+                                            empty_message="No hay semanas para ese mes.")
+
+                        # ZIP con todo el histórico
+                        with col_dl_all:
+                            if st.button("ZIP con TODO"):
+                                show_export("zip_todo", empty_message="No hay archivos semanales.")
             
-            # --- Sección ADMIN: Generar y descargar archivo mensual -----------
-            if worker == "Ricardo Adrian Ruiz":
-                st.markdown("---")
-                st.subheader("Archivo Mensual (nuevo, generado al vuelo)")
-
-                col_year, col_month = st.columns(2)
-                with col_year:
-                    current_year = datetime.now().year
-                    selected_year = st.number_input(
-                        "Elige el año",
-                        min_value=2000,
-                        max_value=current_year + 1,
-                        value=st.session_state.get("selected_year", current_year),
-                        step=1,
-                        key="selected_year",
-                    )
-                with col_month:
-                    month_names = [
-                        "Enero",
-                        "Febrero",
-                        "Marzo",
-                        "Abril",
-                        "Mayo",
-                        "Junio",
-                        "Julio",
-                        "Agosto",
-                        "Septiembre",
-                        "Octubre",
-                        "Noviembre",
-                        "Diciembre",
-                    ]
-                    selected_month_name = st.selectbox(
-                        "Elige el mes",
-                        month_names,
-                        index=st.session_state.get("selected_month_num", datetime.now().month) - 1,
-                        key="selected_month_name",
-                    )
-                    selected_month = month_names.index(selected_month_name) + 1
-                    st.session_state["selected_month_num"] = selected_month
+                # --- Sección ADMIN: Generar y descargar archivo mensual -----------
+                if worker == "Ricardo Adrian Ruiz":
+                    st.markdown("---")
+                    st.subheader("Archivo Mensual (nuevo, generado al vuelo)")
+
+                    col_year, col_month = st.columns(2)
+                    with col_year:
+                        current_year = calendario.now_lima().year
+                        selected_year = st.number_input(
+                            "Elige el año",
+                            min_value=2000,
+                            max_value=current_year + 1,
+                            value=st.session_state.get("selected_year", current_year),
+                            step=1,
+                            key="selected_year",
+                        )
+                    with col_month:
+                        month_names = [
+                            "Enero",
+                            "Febrero",
+                            "Marzo",
+                            "Abril",
+                            "Mayo",
+                            "Junio",
+                            "Julio",
+                            "Agosto",
+                            "Septiembre",
+                            "Octubre",
+                            "Noviembre",
+                            "Diciembre",
+                        ]
+                        selected_month_name = st.selectbox(
+                            "Elige el mes",
+                            month_names,
+                            index=st.session_state.get("selected_month_num", calendario.now_lima().month) - 1,
+                            key="selected_month_name",
+                        )
+                        selected_month = month_names.index(selected_month_name) + 1
+                        st.session_state["selected_month_num"] = selected_month
                 
-                if st.button("Generar archivo mensual"):
-                    output_buffer = generate_monthly_file(selected_year, selected_month)
-                    if output_buffer is not None:
-                        filename = f"registro_{selected_year}_{selected_month:02d}.xlsx"
-                        st.download_button(
-                            label="Descargar archivo mensual",
-                            data=output_buffer,
-                            file_name=filename,
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                    if st.button("Generar archivo mensual"):
+                        show_export("mensual", selected_year, selected_month,
+                                    empty_message="No se encontraron registros para el mes y año seleccionados.",
+                                    label="Descargar archivo mensual")
+
+                # --- Sección ADMIN: Consultas sobre todo el histórico ----------------
+                if worker == "Ricardo Adrian Ruiz":
+                    st.markdown("---")
+                    st.subheader("Consultas del histórico")
+
+                    today = calendario.now_lima().date()
+                    col_from, col_to, col_late = st.columns(3)
+                    with col_from:
+                        query_start = st.date_input("Desde", value=today.replace(day=1), key="analitica_desde")
+                    with col_to:
+                        query_end = st.date_input("Hasta", value=today, key="analitica_hasta")
+                    with col_late:
+                        late_hour = st.number_input(
+                            "Tardanza: entrada desde las (hora)",
+                            min_value=0,
+                            max_value=23,
+                            value=ENTRY_DEADLINE,
+                            step=1,
+                            key="analitica_tardanza",
                         )
-        else:
-            st.error("Contraseña incorrecta. Intente nuevamente.")
+                    query_workers = st.multiselect(
+                        "Trabajadores (vacío = todos)", user_list, key="analitica_trabajadores"
+                    )
+
+                    if st.button("Consultar"):
+                        if query_start > query_end:
+                            st.warning("La fecha inicial es posterior a la final.")
+                        else:
+                            started = time.perf_counter()
+                            records = query_records(query_start, query_end, query_workers)
+                            summary = worker_analytics(records, late_hour)
+                            st.caption(f"{len(records)} registros, consulta resuelta en "
+                                       f"{(time.perf_counter() - started) * 1000:.0f} ms.")
+                            if records.empty:
+                                st.info("No hay registros en ese rango de fechas.")
+                            else:
+                                summary["Horas Trabajadas"] = format_duration(
+                                    summary["Horas Trabajadas"], missing="0:00:00"
+                                )
+                                st.dataframe(summary, hide_index=True)
+                                open_shifts = records[(records["Estado"] == Estado.SIN_SALIDA.value).to_numpy()]
+                                late = records[late_arrivals_mask(records, late_hour)]
+                                with st.expander(f"Turnos sin salida ({len(open_shifts)})"):
+                                    st.dataframe(to_sheet_layout(from_compact(open_shifts)), hide_index=True)
+                                with st.expander(f"Tardanzas ({len(late)})"):
+                                    st.dataframe(to_sheet_layout(from_compact(late)), hide_index=True)
+
+                # --- Sección ADMIN: Tiempos por etapa -----------------------------
+                if worker == "Ricardo Adrian Ruiz":
+                    st.markdown("---")
+                    st.subheader("Tiempos por etapa")
+                    with st.expander("Ver tiempos recientes de este servidor"):
+                        timings = stage_timings_df()
+                        if timings.empty:
+                            st.info("Todavía no hay mediciones en este proceso.")
+                        else:
+                            st.dataframe(timings, hide_index=True)
+                            stage = st.selectbox("Etapa", timings["Etapa"].tolist())
+                            st.bar_chart(stage_histogram_df(stage), x="Duración", y="Llamadas", sort=False)
+            else:
+                st.error("Contraseña incorrecta. Intente nuevamente.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Benchmark de las consultas del histórico (query_records + worker_analytics).
+
+Sube --semanas de historial sintético para --trabajadores al almacenamiento en memoria
+(con --latencia-ms por operación), arma las particiones mensuales de analitica/ y mide:
+  - armado: rebuild_analytics desde los archivos semanales (se hace una sola vez).
+  - todo_frio: consulta de todo el histórico con la caché del proceso vacía.
+  - todo: la misma consulta con las particiones ya en caché.
+  - un_mes_frio: consulta de un mes (debe leer una sola partición).
+  - trabajador: todo el histórico, un solo trabajador.
+  - semana_actual: todos marcan entrada hoy, se consolida la semana actual (como la sección
+    del administrador antes de consultar) y se consulta desde el primer mes del histórico
+    hasta hoy, mezclando la semana recién escrita con las leídas de Parquet.
+Cada consulta incluye el resumen por trabajador (horas, tardanzas y turnos sin salida).
+
+    python benchmarks/bench_analitica.py --trabajadores 200 --semanas 260 --latencia-ms 20
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import app_registros as app
+import calendario
+from almacenamiento import MemoryStorage
+from carga import lima_today_at, synthetic_history
+
+
+def measure(name, fn, storage, repeats, before=lambda: None):
+    """Ejecuta fn `repeats` veces (llamando a `before` antes de cada una) y muestra la mediana."""
+    samples = []
+    reads = 0
+    for _ in range(repeats):
+        before()
+        start_reads = storage.stats["read_blob"]
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+        reads = storage.stats["read_blob"] - start_reads
+    stats = {"mediana_ms": statistics.median(samples) * 1000, "min_ms": min(samples) * 1000, "lecturas": reads}
+    print(f"{name:<13} mediana {stats['mediana_ms']:9.1f}ms  min {stats['min_ms']:9.1f}ms  "
+          f"blobs leídos {reads:<4} {result}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trabajadores", type=int, default=200)
+    parser.add_argument("--semanas", type=int, default=260, help="semanas de historial (260 = 5 años)")
+    parser.add_argument("--latencia-ms", type=float, default=0.0,
+                        help="latencia simulada por operación de almacenamiento")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--json", help="guarda los resultados en este archivo")
+    args = parser.parse_args()
+
+    storage = MemoryStorage()
+    app.set_storage(storage)
+    history = synthetic_history(args.trabajadores, args.semanas, seed=args.semilla)
+    for filename, df in history.items():
+        app.save_week_data_and_upload(df, filename)
+    start = date.fromisoformat(min(df["Fecha"].min() for df in history.values()))
+    end = date.fromisoformat(max(df["Fecha"].max() for df in history.values()))
+    del history
+    storage.latency = args.latencia_ms / 1000
+    app._week_cache.clear()
+
+    def summary(start, end, workers=None):
+        records = app.query_records(start, end, workers)
+        app.worker_analytics(records)
+        return f"{len(records)} filas ({int((records['Fecha'] == end).sum())} del último día)"
+
+    middle = date(start.year + 1, 6, 1)
+    results = {"config": vars(args).copy(), "fases": {}}
+    phases = results["fases"]
+    phases["armado"] = measure("armado", lambda: f"{len(app.rebuild_analytics())} meses", storage, 1)
+    phases["todo_frio"] = measure("todo_frio", lambda: summary(start, end), storage, args.repeticiones,
+                                  before=app._week_cache.clear)
+    phases["todo"] = measure("todo", lambda: summary(start, end), storage, args.repeticiones)
+    phases["un_mes_frio"] = measure("un_mes_frio", lambda: summary(middle, date(middle.year, 6, 30)), storage,
+                                    args.repeticiones, before=app._week_cache.clear)
+    phases["trabajador"] = measure("trabajador", lambda: summary(start, end, ["Trabajador 00001"]), storage,
+                                   args.repeticiones)
+
+    workers = [f"Trabajador {i:05d}" for i in range(args.trabajadores)]
+    rejected = [w for w in workers if not app.register_event(w, "entrada", now_utc=lima_today_at(8))[0]]
+    if rejected:
+        raise SystemExit(f"{len(rejected)} marcaciones rechazadas en la semana actual")
+    app.compact_week(app.get_week_filename())
+    today = calendario.now_lima().date()
+    phases["semana_actual"] = measure("semana_actual", lambda: summary(date(end.year, 1, 1), today), storage,
+                                      args.repeticiones)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark de arranque en frío: desde el import de app_registros hasta el primer render.
+
+Cada muestra corre en un proceso nuevo (sin módulos ya cargados) y mide:
+  - import: tiempo de `import app_registros`.
+  - primer render: ejecución de main() con AppTest hasta mostrar el selector de trabajador.
+  - ingreso: render tras elegir trabajador y contraseña, contra el almacenamiento en
+    memoria (REGISTROS_BACKEND=memoria), sin clientes de Firebase.
+También informa qué módulos pesados quedaron cargados después del import.
+
+    python benchmarks/bench_arranque.py --muestras 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.join(BENCH_DIR, "..")
+
+HEAVY_MODULES = ["openpyxl", "firebase_admin", "google.cloud.firestore_v1", "google.cloud.storage"]
+WORKER = "Nelida Ruiz"
+PASSWORD = "clave"
+
+DRIVER = """
+import app_registros as app
+
+app.main()
+"""
+
+
+def sample():
+    """Una muestra: debe ejecutarse en un proceso recién iniciado."""
+    sys.path.insert(0, REPO_DIR)
+    os.environ["REGISTROS_BACKEND"] = "memoria"
+
+    t0 = time.perf_counter()
+    import app_registros  # noqa: F401
+    import_s = time.perf_counter() - t0
+    loaded = [m for m in HEAVY_MODULES if m in sys.modules]
+
+    from streamlit.testing.v1 import AppTest
+
+    with tempfile.NamedTemporaryFile("w", suffix=".py", delete=False) as f:
+        f.write(DRIVER)
+        driver = f.name
+    try:
+        at = AppTest.from_file(driver, default_timeout=60)
+        at.secrets["user_passwords"] = {WORKER: PASSWORD}
+        t1 = time.perf_counter()
+        at.run()
+        render_s = time.perf_counter() - t1
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+
+        t2 = time.perf_counter()
+        at.selectbox[0].set_value(WORKER).run()
+        at.text_input[0].input(PASSWORD).run()
+        login_s = time.perf_counter() - t2
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+    finally:
+        os.unlink(driver)
+
+    return {
+        "import_s": import_s,
+        "primer_render_s": render_s,
+        "ingreso_s": login_s,
+        "modulos_tras_import": loaded,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--muestras", type=int, default=5)
+    parser.add_argument("--json", help="guarda los resultados en este archivo")
+    parser.add_argument("--muestra", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.muestra:
+        print(json.dumps(sample()))
+        return
+
+    samples = []
+    for _ in range(args.muestras):
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), "--muestra"],
+                             check=True, capture_output=True, text=True).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+
+    results = {"muestras": len(samples)}
+    for key in ("import_s", "primer_render_s", "ingreso_s"):
+        values = [s[key] for s in samples]
+        results[key] = {"mediana": statistics.median(values), "min": min(values)}
+    results["modulos_tras_import"] = samples[0]["modulos_tras_import"]
+
+    for key in ("import_s", "primer_render_s", "ingreso_s"):
+        print(f"{key:<16} mediana {results[key]['mediana']:.3f}s  min {results[key]['min']:.3f}s")
+    print("módulos pesados tras el import:", ", ".join(results["modulos_tras_import"]) or "ninguno")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
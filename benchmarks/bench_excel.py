@@ -0,0 +1,86 @@
+"""
+Benchmark de la generación del Excel con estilo (hojas 'Registros' y 'Resumen').
+
+Compara la implementación anterior (pandas.ExcelWriter + autoajuste y bordes celda por celda)
+con render_workbook (modo de solo escritura, anchos vectorizados, bordes por formato condicional):
+
+    python benchmarks/bench_excel.py --filas 50000
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pandas as pd
+from openpyxl.styles import Border, Side
+
+import app_registros as app
+from bench_resumen import synthetic_week
+
+
+def legacy_render(sheets):
+    """Copia del código anterior de save_week_data_and_upload / generate_monthly_file."""
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        for sheet_name, df in sheets.items():
+            df.to_excel(writer, sheet_name=sheet_name, index=False)
+            ws = writer.sheets[sheet_name]
+            for col_cells in ws.columns:
+                max_length = 0
+                col_letter = col_cells[0].column_letter
+                for cell in col_cells:
+                    if cell.value:
+                        cell_length = len(str(cell.value))
+                        if cell_length > max_length:
+                            max_length = cell_length
+                ws.column_dimensions[col_letter].width = max_length + 2
+
+        thin_border = Border(
+            left=Side(style="thin"),
+            right=Side(style="thin"),
+            top=Side(style="thin"),
+            bottom=Side(style="thin")
+        )
+        for ws_sheet in writer.sheets.values():
+            for row in ws_sheet.iter_rows():
+                for cell in row:
+                    cell.border = thin_border
+    output.seek(0)
+    return output
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, default=50_000)
+    parser.add_argument("--trabajadores", type=int, default=200)
+    args = parser.parse_args()
+
+    df = synthetic_week(args.filas, args.trabajadores)
+    sheets = {"Registros": app.to_sheet_layout(df), "Resumen": app.create_summary_df(df)}
+    print(f"{args.filas} filas, {args.trabajadores} trabajadores")
+
+    new, t_new = timed(app.render_workbook, sheets)
+    print(f"actual   (render_workbook):        {t_new:7.2f} s  {len(new.getvalue()) / 1e6:6.1f} MB")
+    old, t_old = timed(legacy_render, sheets)
+    print(f"anterior (celda por celda):        {t_old:7.2f} s  {len(old.getvalue()) / 1e6:6.1f} MB  ({t_old / t_new:.1f}x)")
+
+    same = all(
+        pd.read_excel(new, sheet_name=name).equals(pd.read_excel(old, sheet_name=name))
+        for name in sheets
+    )
+    print(f"contenido idéntico: {same}")
+    if not same:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark de memoria de los históricos: formato de texto de la hoja frente a la
+representación compacta (to_compact).
+
+Genera --semanas de historial sintético para --trabajadores, lo sube al almacenamiento en
+memoria y lo carga entero de las dos formas:
+  - texto: pd.concat de load_week_data de cada semana (como hoy en los reportes), y la
+    misma tabla con columnas object (como la leía pandas 2).
+  - compacta: load_compact_weeks.
+Informa la memoria de cada tabla (memory_usage(deep=True)), bytes por fila, tiempo de carga,
+el tiempo de un total de horas por trabajador sobre todo el histórico, y verifica que
+from_compact devuelva exactamente la hoja original.
+
+    python benchmarks/bench_memoria.py --trabajadores 200 --semanas 156
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pandas as pd
+
+import app_registros as app
+from almacenamiento import MemoryStorage
+from carga import synthetic_history
+
+
+def measure(df):
+    return int(df.memory_usage(deep=True).sum())
+
+
+def timed_call(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trabajadores", type=int, default=200)
+    parser.add_argument("--semanas", type=int, default=156, help="semanas de historial (156 = 3 años)")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--json", help="guarda los resultados en este archivo")
+    args = parser.parse_args()
+
+    app.set_storage(MemoryStorage())
+    history = synthetic_history(args.trabajadores, args.semanas, seed=args.semilla)
+    for filename, df in history.items():
+        app.save_week_data_and_upload(df, filename)
+    week_files = sorted(history)
+    del history
+    app._week_cache.clear()
+
+    text, text_s = timed_call(lambda: pd.concat(
+        [app.load_week_data(f, cache=False) for f in week_files], ignore_index=True
+    ))
+    legacy = text.astype({c: object for c in ["Nombre", "Fecha", "Entrada", "Salida"]})
+    compact, compact_s = timed_call(lambda: app.load_compact_weeks(week_files))
+
+    pd.testing.assert_frame_equal(
+        app.to_sheet_layout(app.from_compact(compact)), app.to_sheet_layout(text), check_dtype=False
+    )
+
+    _, text_query_s = timed_call(
+        lambda: app.hours_to_timedelta(text["Horas Trabajadas"]).groupby(text["Nombre"]).sum()
+    )
+    _, compact_query_s = timed_call(
+        lambda: compact["Duracion"].groupby(compact["Nombre"], observed=True).sum()
+    )
+
+    rows = len(compact)
+    results = {
+        "filas": rows,
+        "semanas": len(week_files),
+        "trabajadores": args.trabajadores,
+        "bytes": {"texto": measure(text), "texto_object": measure(legacy), "compacta": measure(compact)},
+        "carga_s": {"texto": text_s, "compacta": compact_s},
+        "horas_por_trabajador_s": {"texto": text_query_s, "compacta": compact_query_s},
+    }
+
+    print(f"{rows} filas ({len(week_files)} semanas, {args.trabajadores} trabajadores); "
+          f"from_compact reproduce la hoja original")
+    for name, size in results["bytes"].items():
+        print(f"  {name:<13} {size / 1e6:9.2f} MB  {size / rows:7.1f} B/fila  "
+              f"x{size / results['bytes']['compacta']:5.2f} de la compacta")
+    print(f"  carga:                texto {text_s:7.3f}s  compacta {compact_s:7.3f}s")
+    print(f"  horas por trabajador: texto {text_query_s * 1000:7.1f}ms  compacta {compact_query_s * 1000:7.1f}ms")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
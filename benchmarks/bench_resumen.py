@@ -0,0 +1,97 @@
+"""
+Microbenchmark del resumen de horas por trabajador.
+
+Compara la implementación anterior (iterrows + parse_timedelta sobre texto 'H:MM:SS')
+con la actual (groupby().sum() sobre timedelta64) en un conjunto sintético:
+
+    python benchmarks/bench_resumen.py --filas 1000000 --trabajadores 200
+
+La versión anterior recorre fila por fila; con 1M de filas tarda minutos.
+Use --sin-anterior para medir solo la versión actual.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+import pandas as pd
+
+import app_registros as app
+
+
+def legacy_parse_timedelta(td_str):
+    """Copia de la función anterior: convierte 'H:MM:SS' en timedelta."""
+    try:
+        h, m, s = map(int, td_str.split(':'))
+        return timedelta(hours=h, minutes=m, seconds=s)
+    except Exception:
+        return timedelta()
+
+
+def legacy_create_summary_df(df):
+    """Copia de la implementación anterior de create_summary_df."""
+    summary = {}
+    for name in df["Nombre"].unique():
+        valid = df[(df["Nombre"] == name) & (df["Horas Trabajadas"].notna())]
+        total = timedelta()
+        for _, row in valid.iterrows():
+            total += legacy_parse_timedelta(row["Horas Trabajadas"])
+        summary[name] = str(total)
+    summary_df = pd.DataFrame(list(summary.items()), columns=["Nombre", "Total Horas Trabajadas"])
+    summary_df = summary_df.sort_values("Nombre")
+    return summary_df
+
+
+def synthetic_week(rows, workers, seed=0):
+    """Registros sintéticos con el esquema interno; ~5% sin salida."""
+    rng = np.random.default_rng(seed)
+    seconds = rng.integers(4 * 3600, 10 * 3600, size=rows)
+    hours = pd.Series(pd.to_timedelta(seconds, unit="s"))
+    hours[rng.random(rows) < 0.05] = pd.NaT
+    return pd.DataFrame({
+        "Nombre": pd.Series([f"Trabajador {i:05d}" for i in range(workers)]).sample(
+            rows, replace=True, random_state=seed
+        ).to_numpy(),
+        "Fecha": "2024-03-04",
+        "Entrada": "04/03/2024 08:55:00 AM",
+        "Salida": "04/03/2024 05:00:00 PM",
+        "Horas Trabajadas": hours,
+    })
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, default=1_000_000)
+    parser.add_argument("--trabajadores", type=int, default=200)
+    parser.add_argument("--sin-anterior", action="store_true")
+    args = parser.parse_args()
+
+    df = synthetic_week(args.filas, args.trabajadores)
+    print(f"{args.filas} filas, {args.trabajadores} trabajadores")
+
+    new, t_new = timed(app.create_summary_df, df)
+    print(f"actual   (groupby timedelta64): {t_new:8.3f} s")
+
+    if not args.sin_anterior:
+        # La versión anterior trabajaba sobre el texto de la hoja
+        sheet = app.to_sheet_layout(df)
+        old, t_old = timed(legacy_create_summary_df, sheet)
+        print(f"anterior (iterrows + texto):    {t_old:8.3f} s   ({t_old / t_new:.0f}x)")
+        same = new.reset_index(drop=True).equals(old.reset_index(drop=True))
+        print(f"resultados idénticos: {same}")
+        if not same:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""
+Pruebas de carga de las rutas de marcación y de reportes, contra el almacenamiento en memoria.
+
+Genera una plantilla sintética (--trabajadores, de 10 a 10.000) con --semanas de historial
+ya consolidado en Parquet, más los demás días hábiles de la semana actual (filas consolidadas
+sin eventos, como las anteriores a la bitácora), y mide, fase por fase:
+  - marcacion_entrada / marcacion_salida: ráfagas de register_event de todos los
+    trabajadores a la vez (--hilos en paralelo), con la hora fijada dentro del horario,
+    sobre una semana actual que ya tiene ~4 filas por trabajador.
+  - horas_semana: get_worker_week_hours de cada trabajador.
+  - resumen: create_summary_df de cada semana del historial.
+  - reporte_mensual: generate_monthly_file del mes actual.
+  - reporte_mensual_cache: request_export del mismo mes, ya guardado en exportaciones/.
+  - zip: zip_blobs de todas las semanas.
+Por fase informa latencia p50/p95/p99, operaciones por segundo, bytes leídos y escritos en
+el almacenamiento, bytes generados (Excel/ZIP) y el pico de memoria residente del proceso.
+
+    python benchmarks/carga.py --trabajadores 1000 --semanas 52 --latencia-ms 5 --json carga.json
+    python benchmarks/carga.py --trabajadores 1000 --semanas 52 --comparar carga.json
+
+Con --comparar, termina con código 1 si el p95 de alguna fase empeora más que --umbral.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time as dtime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+import pandas as pd
+import pytz
+
+import app_registros as app
+from almacenamiento import MemoryStorage
+
+LIMA = pytz.timezone("America/Lima")
+
+
+def synthetic_history(workers, weeks, seed=0, current_week=False):
+    """
+    Semanas consolidadas anteriores a la actual: cada trabajador marca de lunes a viernes,
+    entre las 8 y las 9 de la mañana y ocho a nueve horas después; ~5% sin salida.
+    Con current_week, también la semana actual con los días hábiles distintos de hoy (aunque
+    sean posteriores, así el tamaño de la semana no depende del día en que se corre), como
+    filas ya consolidadas sin eventos en la bitácora.
+    Devuelve {nombre de archivo: DataFrame con el esquema interno}.
+    """
+    rng = np.random.default_rng(seed)
+    names = np.array([f"Trabajador {i:05d}" for i in range(workers)])
+    today = datetime.now(LIMA).date()
+    this_monday = today - timedelta(days=today.weekday())
+    weekdays = {k: [this_monday - timedelta(weeks=k) + timedelta(days=d) for d in range(5)]
+                for k in range(weeks, 0, -1)}
+    if current_week:
+        weekdays[0] = [this_monday + timedelta(days=d) for d in range(5) if this_monday + timedelta(days=d) != today]
+    history = {}
+    for k, week_days in weekdays.items():
+        monday = this_monday - timedelta(weeks=k)
+        days = pd.to_datetime(week_days)
+        dates = np.repeat(days.to_numpy(), workers)
+        entries = pd.Series(dates + pd.to_timedelta(rng.integers(8 * 3600, 9 * 3600, dates.size), unit="s"))
+        worked = pd.Series(pd.to_timedelta(rng.integers(8 * 3600, 9 * 3600, dates.size), unit="s"))
+        worked[rng.random(dates.size) < 0.05] = pd.NaT
+        exits = (entries + worked).dt.strftime(app.TIMESTAMP_FORMAT).fillna(app.NO_EXIT)
+        history[app.get_week_filename(monday)] = pd.DataFrame({
+            "Nombre": np.tile(names, len(week_days)),
+            "Fecha": pd.Series(dates).dt.strftime("%Y-%m-%d"),
+            "Entrada": entries.dt.strftime(app.TIMESTAMP_FORMAT),
+            "Salida": exits,
+            "Horas Trabajadas": worked,
+        })
+    return history
+
+
+def lima_today_at(hour, seconds=0):
+    """Hora de hoy en Lima (más `seconds`), en UTC."""
+    local = LIMA.localize(datetime.combine(datetime.now(LIMA).date(), dtime(hour)))
+    return (local + timedelta(seconds=seconds)).astimezone(pytz.utc)
+
+
+def peak_rss_mb():
+    """Pico de memoria residente del proceso hasta ahora (ru_maxrss está en KB en Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_phase(name, calls, storage, threads=1, ok=lambda result: True, size=lambda result: 0):
+    """
+    Ejecuta las llamadas (funciones sin argumentos) con `threads` hilos y mide cada una.
+    `ok` decide si el resultado cuenta como éxito y `size` cuántos bytes generó.
+    """
+    def timed(fn):
+        start = time.perf_counter()
+        result = fn()
+        return time.perf_counter() - start, ok(result), size(result)
+
+    before = Counter(storage.stats)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        samples = list(executor.map(timed, calls))
+    wall = time.perf_counter() - start
+    transferred = Counter(storage.stats)
+    transferred.subtract(before)
+
+    latencies = np.array([s[0] for s in samples]) * 1000
+    stats = {
+        "n": len(samples),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "ops_s": len(samples) / wall if wall else 0.0,
+        "errores": sum(not s[1] for s in samples),
+        "bytes_leidos": transferred["bytes_leidos"],
+        "bytes_escritos": transferred["bytes_escritos"],
+        "bytes_generados": sum(s[2] for s in samples),
+        "documentos_leidos": transferred["documentos_leidos"],
+        "documentos_escritos": transferred["documentos_escritos"],
+        "rss_pico_mb": peak_rss_mb(),
+    }
+    print(f"{name:<21} n={stats['n']:<6} p50={stats['p50_ms']:9.2f}ms p95={stats['p95_ms']:9.2f}ms "
+          f"p99={stats['p99_ms']:9.2f}ms {stats['ops_s']:9.1f} op/s err={stats['errores']:<4} "
+          f"leídos={stats['bytes_leidos'] / 1e6:8.2f}MB escritos={stats['bytes_escritos'] / 1e6:8.2f}MB "
+          f"generados={stats['bytes_generados'] / 1e6:8.2f}MB rss={stats['rss_pico_mb']:7.1f}MB")
+    return stats
+
+
+def zip_size(buf):
+    size = buf.seek(0, os.SEEK_END)
+    buf.close()
+    return size
+
+
+def run(args):
+    storage = MemoryStorage(latency=args.latencia_ms / 1000)
+    app.set_storage(storage)
+    app._week_cache.clear()
+
+    history = synthetic_history(args.trabajadores, args.semanas, seed=args.semilla, current_week=True)
+    for filename, df in history.items():
+        app.save_week_data_and_upload(df, filename)
+    workers = [f"Trabajador {i:05d}" for i in range(args.trabajadores)]
+    print(f"{args.trabajadores} trabajadores, {args.semanas} semanas de historial más la actual "
+          f"({sum(len(df) for df in history.values())} filas), latencia {args.latencia_ms} ms, "
+          f"{args.hilos} hilos")
+
+    phases = {}
+    register_ok = lambda result: result[0]
+    phases["marcacion_entrada"] = run_phase("marcacion_entrada", [
+        lambda w=w, i=i: app.register_event(w, "entrada", now_utc=lima_today_at(8, i % 3600))
+        for i, w in enumerate(workers)
+    ], storage, threads=args.hilos, ok=register_ok)
+    phases["marcacion_salida"] = run_phase("marcacion_salida", [
+        lambda w=w, i=i: app.register_event(w, "salida", now_utc=lima_today_at(17, i % 3600))
+        for i, w in enumerate(workers)
+    ], storage, threads=args.hilos, ok=register_ok)
+    phases["horas_semana"] = run_phase("horas_semana", [
+        lambda w=w: app.get_worker_week_hours(w) for w in workers
+    ], storage, threads=args.hilos)
+    phases["resumen"] = run_phase("resumen", [
+        lambda df=df: app.create_summary_df(df) for df in history.values()
+    ], storage)
+
+    # Los reportes empiezan con la caché de semanas vacía (como un proceso recién iniciado):
+    # la primera repetición descarga las semanas y las siguientes las reutilizan.
+    today = datetime.now(LIMA)
+    app._week_cache.clear()
+    phases["reporte_mensual"] = run_phase("reporte_mensual", [
+        lambda: app.generate_monthly_file(today.year, today.month) for _ in range(args.repeticiones)
+    ], storage, ok=lambda result: result is not None, size=lambda result: len(result.getvalue()) if result is not None else 0)
+    # Con el reporte ya guardado en exportaciones/, un pedido solo lee el archivo
+    app.refresh_export("mensual", today.year, today.month)
+    phases["reporte_mensual_cache"] = run_phase("reporte_mensual_cache", [
+        lambda: app.request_export("mensual", today.year, today.month) for _ in range(args.repeticiones)
+    ], storage, ok=lambda result: result[1] == "vigente",
+        size=lambda result: len(result[0]) if result[0] is not None else 0)
+    app._week_cache.clear()
+    phases["zip"] = run_phase("zip", [
+        lambda: app.zip_blobs(app.list_week_files()) for _ in range(args.repeticiones)
+    ], storage, size=zip_size)
+
+    return {
+        "version": git_version(),
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "trabajadores": args.trabajadores,
+            "semanas": args.semanas,
+            "latencia_ms": args.latencia_ms,
+            "hilos": args.hilos,
+            "repeticiones": args.repeticiones,
+            "semilla": args.semilla,
+        },
+        "fases": phases,
+    }
+
+
+def git_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Compara el p95 de cada fase con el de una corrida anterior. Devuelve True si no hay regresiones."""
+    if baseline.get("config") != results["config"]:
+        print("aviso: la corrida anterior usó otra configuración:", baseline.get("config"))
+    passed = True
+    print(f"\ncomparación con {baseline.get('version')} (umbral p95 +{threshold:.0%}):")
+    for name, stats in results["fases"].items():
+        old = baseline.get("fases", {}).get(name)
+        if not old or not old["p95_ms"]:
+            continue
+        ratio = stats["p95_ms"] / old["p95_ms"]
+        regression = ratio > 1 + threshold
+        passed &= not regression
+        print(f"  {name:<21} p95 {old['p95_ms']:9.2f}ms -> {stats['p95_ms']:9.2f}ms  "
+              f"x{ratio:5.2f}{'  REGRESIÓN' if regression else ''}")
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trabajadores", type=int, default=100)
+    parser.add_argument("--semanas", type=int, default=8)
+    parser.add_argument("--latencia-ms", type=float, default=0.0,
+                        help="latencia simulada por operación de almacenamiento")
+    parser.add_argument("--hilos", type=int, default=16, help="llamadas simultáneas en las ráfagas")
+    parser.add_argument("--repeticiones", type=int, default=3, help="veces que se genera cada reporte")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--json", help="guarda los resultados en este archivo")
+    parser.add_argument("--comparar", help="resultados JSON de una corrida anterior")
+    parser.add_argument("--umbral", type=float, default=0.2, help="empeoramiento tolerado del p95 (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.comparar:
+        with open(args.comparar) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.umbral):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
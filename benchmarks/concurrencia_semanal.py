@@ -0,0 +1,144 @@
+"""
+Arnés multihilo que verifica que las escrituras concurrentes sobre un mismo archivo
+semanal no pierden actualizaciones.
+
+Se ejecuta contra el almacenamiento en memoria (almacenamiento.MemoryStorage):
+
+    python benchmarks/concurrencia_semanal.py --hilos 16
+
+Escenarios:
+  1. Lectura-modificación-escritura directa: cada hilo agrega su propia fila con
+     update_week_blob. Sin precondiciones se pierden filas; con ellas, ninguna.
+  2. Marcaciones + consolidación: cada hilo agrega un evento a la bitácora y
+     consolida la semana con compact_week al mismo tiempo que los demás.
+Termina con código 1 si el modo condicional pierde alguna actualización en silencio.
+Con muchos hilos, un escritor puede agotar MAX_WRITE_RETRIES: se reporta como
+"rechazada" (el llamador recibe el error), nunca como pérdida silenciosa.
+"""
+import argparse
+import os
+import sys
+import threading
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pandas as pd
+
+import app_registros as app
+from almacenamiento import MemoryStorage
+
+FILENAME = "registro_2024_W10.xlsx"
+
+
+def run_threads(n, target):
+    barrier = threading.Barrier(n)
+    errors = []
+
+    def worker(i):
+        barrier.wait()
+        try:
+            target(i)
+        except Exception as e:  # noqa: BLE001 - se reporta al final
+            errors.append((i, e))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return errors
+
+
+def append_row(i):
+    def mutate(df, metadata):
+        row = {
+            "Nombre": f"Trabajador {i:03d}",
+            "Fecha": "2024-03-04",
+            "Entrada": "04/03/2024 08:55:00 AM",
+            "Salida": app.NO_EXIT,
+            "Horas Trabajadas": pd.NaT,
+        }
+        return pd.concat([df, pd.DataFrame([row])], ignore_index=True), metadata
+    return mutate
+
+
+def naive_update(filename, mutate):
+    """Versión sin precondición (equivalente al código anterior): el último en escribir gana."""
+    df, _, metadata = app._read_week_blob_versioned(filename)
+    new_df, new_metadata = mutate(df, metadata)
+    app.save_week_data_and_upload(new_df, filename, new_metadata)
+
+
+def present_workers(filename):
+    return set(app._read_week_blob(filename)["Nombre"])
+
+
+def report(label, n, errors, present):
+    """Una actualización perdida es la de un hilo que terminó sin error y cuya fila no quedó."""
+    failed = {i for i, _ in errors}
+    lost = [i for i in range(n) if i not in failed and f"Trabajador {i:03d}" not in present]
+    print(f"{label} escritas={len(present)}/{n} perdidas={len(lost)} rechazadas={len(failed)}")
+    for i, e in errors:
+        print(f"  hilo {i}: {e!r}")
+    return not lost
+
+
+def reset_backend(latency):
+    app.set_storage(MemoryStorage(latency=latency))
+    # Las generaciones del almacenamiento nuevo empiezan de cero: la caché anterior ya no aplica.
+    app._week_cache.clear()
+
+
+def scenario_read_modify_write(n, latency, conditional):
+    reset_backend(latency)
+    if conditional:
+        errors = run_threads(n, lambda i: app.update_week_blob(FILENAME, append_row(i)))
+    else:
+        errors = run_threads(n, lambda i: naive_update(FILENAME, append_row(i)))
+    return errors, present_workers(FILENAME)
+
+
+def scenario_events_and_compaction(n, latency):
+    reset_backend(latency)
+    start = datetime(2024, 3, 4, 13, 55, tzinfo=timezone.utc)
+
+    def punch_and_compact(i):
+        worker = f"Trabajador {i:03d}"
+        ts = start + timedelta(seconds=i)
+        app.append_event(worker, "2024-03-04", "entrada", {
+            "Nombre": worker,
+            "Fecha": "2024-03-04",
+            "Semana": FILENAME,
+            "Evento": "entrada",
+            "Timestamp": app.format_datetime(ts),
+            "TimestampUTC": ts,
+        })
+        app.compact_week(FILENAME)
+
+    errors = run_threads(n, punch_and_compact)
+    # Cualquier evento que haya llegado después de la última consolidación queda en la bitácora.
+    app.compact_week(FILENAME)
+    return errors, present_workers(FILENAME)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hilos", type=int, default=16)
+    parser.add_argument("--latencia", type=float, default=0.005, help="segundos por operación simulada")
+    args = parser.parse_args()
+
+    errors, present = scenario_read_modify_write(args.hilos, args.latencia, conditional=False)
+    report("[sin precondición]  ", args.hilos, errors, present)
+
+    errors, present = scenario_read_modify_write(args.hilos, args.latencia, conditional=True)
+    ok = report("[con precondición]  ", args.hilos, errors, present)
+
+    errors, present = scenario_events_and_compaction(args.hilos, args.latencia)
+    ok &= report("[eventos+consolidar]", args.hilos, errors, present)
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
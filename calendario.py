@@ -0,0 +1,70 @@
+"""
+Reloj y calendario de la aplicación. Todas las fechas de negocio (día de la marcación,
+semana ISO, archivo semanal, mes) se derivan en hora de Lima a partir de un instante UTC,
+así una marcación cerca de la medianoche UTC cae en el día y la semana correctos sin
+importar la zona horaria del servidor.
+
+El reloj es inyectable: set_clock(fixed_clock(instante)) fija "ahora" para que las
+importaciones, los reprocesos históricos y los benchmarks sean deterministas.
+"""
+from datetime import datetime
+
+import pytz
+
+LIMA_TZ = pytz.timezone("America/Lima")
+
+
+def system_clock():
+    """Instante actual en UTC (con zona horaria)."""
+    return datetime.now(pytz.utc)
+
+
+def fixed_clock(when):
+    """Reloj detenido en `when` (datetime con zona horaria)."""
+    return lambda: when
+
+
+_clock = system_clock
+
+
+def set_clock(clock):
+    """
+    Reemplaza el reloj: una función sin argumentos que devuelve un datetime con zona horaria.
+    Con None se vuelve al reloj del sistema.
+    """
+    global _clock
+    _clock = clock if clock is not None else system_clock
+
+
+def now_utc():
+    return _clock().astimezone(pytz.utc)
+
+
+def to_lima(utc_dt):
+    """Convierte un datetime con zona horaria (p. ej. UTC) a la hora de Lima."""
+    return utc_dt.astimezone(LIMA_TZ)
+
+
+def now_lima():
+    return to_lima(now_utc())
+
+
+def localize_lima(naive_dt):
+    """Interpreta un datetime sin zona horaria como hora de Lima."""
+    return LIMA_TZ.localize(naive_dt)
+
+
+def date_str(local_dt=None):
+    """Fecha 'YYYY-MM-DD' en Lima (de ahora o de la hora de Lima dada)."""
+    return (local_dt or now_lima()).strftime("%Y-%m-%d")
+
+
+def week_filename(local_dt=None):
+    """Archivo semanal 'registro_YYYY_Www.xlsx' de la semana ISO (de ahora en Lima o de la fecha dada)."""
+    year, week, _ = (local_dt or now_lima()).isocalendar()
+    return f"registro_{year}_W{week}.xlsx"
+
+
+def epoch_seconds(utc_dt):
+    """Segundos enteros desde la época Unix de un datetime con zona horaria."""
+    return int(utc_dt.timestamp())
@@ -0,0 +1,206 @@
+"""
+Comandos de mantenimiento (fuera de la interfaz de Streamlit).
+
+Uso:
+    python comandos.py migrar-parquet [--sobrescribir]
+    python comandos.py reconstruir-agregados [--solo-verificar]
+    python comandos.py poblar-historial [--simular]
+    python comandos.py reconstruir-catalogo
+    python comandos.py importar-marcaciones ARCHIVO [--formato csv|json] [--simular] [--rechazos ARCHIVO]
+    python comandos.py actualizar-exportaciones [--mes AAAA-MM ...] [--todo] [--forzar]
+    python comandos.py reconstruir-analitica [--forzar]
+    python comandos.py consultar-horas --desde AAAA-MM-DD --hasta AAAA-MM-DD [--trabajador NOMBRE ...] [--tardanza HORA]
+
+Las credenciales se leen de .streamlit/secrets.toml, igual que en la app.
+"""
+import argparse
+import csv
+import itertools
+import json
+import sys
+from datetime import date
+
+import app_registros as app
+
+
+def cmd_migrar_parquet(args):
+    """Crea la copia Parquet de cada registro_*.xlsx existente en Firebase Storage."""
+    migrated = skipped = 0
+    for filename in app.list_week_files():
+        if app.migrate_week_to_parquet(filename, overwrite=args.sobrescribir):
+            migrated += 1
+            print(f"migrado: {filename} -> {app.parquet_name(filename)}")
+        else:
+            skipped += 1
+    print(f"{migrated} semanas migradas, {skipped} sin cambios.")
+
+
+def cmd_reconstruir_agregados(args):
+    """Recalcula los totales por trabajador desde los registros semanales y muestra las diferencias."""
+    differences = app.rebuild_aggregates(dry_run=args.solo_verificar)
+    for doc_id, stored, expected in differences:
+        print(f"{doc_id}: guardado={stored} recalculado={expected}")
+    if args.solo_verificar:
+        print(f"{len(differences)} totales no coinciden.")
+    else:
+        print(f"{len(differences)} totales corregidos.")
+
+
+def cmd_poblar_historial(args):
+    """Crea en Firestore los eventos de las semanas anteriores a la bitácora."""
+    written = app.backfill_events(dry_run=args.simular)
+    verb = "se escribirían" if args.simular else "escritos"
+    print(f"{written} eventos {verb}.")
+
+
+def cmd_reconstruir_catalogo(args):
+    """Rearma el catálogo de archivos semanales listando Firebase Storage."""
+    entries = app.rebuild_catalog()
+    print(f"{len(entries)} semanas en el catálogo.")
+
+
+def read_punches(file, fmt):
+    """
+    Lee marcaciones (Nombre, Evento, Timestamp) de un CSV con encabezado, de un arreglo JSON
+    o de JSON Lines (un objeto por línea). El CSV y JSON Lines se leen a medida que se recorren.
+    """
+    if fmt == "csv":
+        yield from csv.DictReader(file)
+        return
+    first = file.read(1)
+    while first.isspace():
+        first = file.read(1)
+    if first == "[":
+        yield from json.loads(first + file.read())
+        return
+    for line in itertools.chain([first + file.readline()], file):
+        if line.strip():
+            yield json.loads(line)
+
+
+def cmd_importar_marcaciones(args):
+    """Importa marcaciones en bloque con las mismas reglas que la app (ver app.import_events)."""
+    fmt = args.formato or ("csv" if args.archivo.lower().endswith(".csv") else "json")
+    with (sys.stdin if args.archivo == "-" else open(args.archivo, newline="", encoding="utf-8")) as f:
+        imported, rejected = app.import_events(read_punches(f, fmt), dry_run=args.simular)
+
+    weeks = sorted({e["Semana"] for e in imported})
+    verb = "se importarían" if args.simular else "importadas"
+    print(f"{len(imported)} marcaciones {verb} ({len(weeks)} semanas), {len(rejected)} rechazadas.")
+    for number, record, reason in rejected[:20]:
+        print(f"  registro {number}: {reason} {record}")
+    if len(rejected) > 20:
+        print(f"  ... y {len(rejected) - 20} más.")
+    if args.rechazos:
+        with open(args.rechazos, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["Registro", "Nombre", "Evento", "Timestamp", "Motivo"])
+            for number, record, reason in rejected:
+                row = record if isinstance(record, dict) else {}
+                writer.writerow([number, row.get("Nombre"), row.get("Evento"), row.get("Timestamp"), reason])
+
+
+def month_arg(value):
+    """'2024-03' -> (2024, 3)."""
+    try:
+        year, month = map(int, value.split("-"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"mes inválido: {value} (se espera AAAA-MM)")
+    if not 1 <= month <= 12:
+        raise argparse.ArgumentTypeError(f"mes inválido: {value} (se espera AAAA-MM)")
+    return year, month
+
+
+def cmd_actualizar_exportaciones(args):
+    """
+    Regenera las exportaciones guardadas cuyas semanas cambiaron (pensado para ejecutarse
+    periódicamente, p. ej. con cron), más las que se pidan con --mes y --todo.
+    """
+    app.compact_pending_weeks()
+    exports = set(app.stored_exports())
+    for year, month in args.mes:
+        exports.update({("mensual", year, month), ("zip_mes", year, month)})
+    if args.todo:
+        exports.add(("zip_todo", None, None))
+    for kind, year, month in sorted(exports, key=lambda e: (e[0], e[1] or 0, e[2] or 0)):
+        blob = app.refresh_export(kind, year, month, force=args.forzar)
+        state = "vacío" if blob.metadata.get("vacio") else f"{blob.size} bytes"
+        print(f"{blob.name}: {state}")
+
+
+def cmd_reconstruir_analitica(args):
+    """Arma las particiones mensuales de analitica/ que falten o estén desactualizadas."""
+    rows = app.rebuild_analytics(force=args.forzar)
+    for month, count in rows.items():
+        print(f"{month}: {count} filas")
+    print(f"{len(rows)} meses en analitica/.")
+
+
+def cmd_consultar_horas(args):
+    """Horas, tardanzas y turnos sin salida por trabajador en un rango de fechas."""
+    records = app.query_records(args.desde, args.hasta, args.trabajador)
+    summary = app.worker_analytics(records, late_hour=args.tardanza)
+    summary["Horas Trabajadas"] = app.format_duration(summary["Horas Trabajadas"], missing="0:00:00")
+    print(summary.to_string(index=False) if not summary.empty else "No hay registros en ese rango de fechas.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Comandos de mantenimiento de registros.")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("migrar-parquet", help="convierte los registro_*.xlsx existentes a Parquet")
+    p.add_argument("--sobrescribir", action="store_true",
+                   help="reescribe también las semanas que ya tienen Parquet")
+    p.set_defaults(func=cmd_migrar_parquet)
+
+    p = sub.add_parser("reconstruir-agregados",
+                       help="recalcula los totales semanales y mensuales desde los registros")
+    p.add_argument("--solo-verificar", action="store_true",
+                   help="solo compara con los totales guardados, sin escribir")
+    p.set_defaults(func=cmd_reconstruir_agregados)
+
+    p = sub.add_parser("poblar-historial",
+                       help="crea el historial de eventos en Firestore desde los archivos semanales")
+    p.add_argument("--simular", action="store_true", help="solo cuenta los eventos, sin escribir")
+    p.set_defaults(func=cmd_poblar_historial)
+
+    p = sub.add_parser("reconstruir-catalogo",
+                       help="rearma el catálogo de archivos semanales desde Firebase Storage")
+    p.set_defaults(func=cmd_reconstruir_catalogo)
+
+    p = sub.add_parser("importar-marcaciones",
+                       help="importa marcaciones (Nombre, Evento, Timestamp) desde CSV o JSON")
+    p.add_argument("archivo", help="archivo .csv, .json o .jsonl ('-' para leer de la entrada estándar)")
+    p.add_argument("--formato", choices=["csv", "json"], help="por defecto se deduce de la extensión")
+    p.add_argument("--simular", action="store_true", help="solo valida, sin escribir")
+    p.add_argument("--rechazos", help="guarda los registros rechazados y sus motivos en este CSV")
+    p.set_defaults(func=cmd_importar_marcaciones)
+
+    p = sub.add_parser("actualizar-exportaciones",
+                       help="regenera los reportes mensuales y ZIP guardados cuyas semanas cambiaron")
+    p.add_argument("--mes", type=month_arg, action="append", default=[],
+                   help="genera también el reporte y el ZIP de este mes (AAAA-MM; se puede repetir)")
+    p.add_argument("--todo", action="store_true", help="genera también el ZIP con todo el histórico")
+    p.add_argument("--forzar", action="store_true", help="regenera aunque las semanas no hayan cambiado")
+    p.set_defaults(func=cmd_actualizar_exportaciones)
+
+    p = sub.add_parser("reconstruir-analitica",
+                       help="arma el histórico compacto particionado por mes que usan las consultas")
+    p.add_argument("--forzar", action="store_true", help="rearma también los meses vigentes")
+    p.set_defaults(func=cmd_reconstruir_analitica)
+
+    p = sub.add_parser("consultar-horas",
+                       help="horas, tardanzas y turnos sin salida por trabajador en un rango de fechas")
+    p.add_argument("--desde", type=date.fromisoformat, required=True, help="fecha inicial (AAAA-MM-DD)")
+    p.add_argument("--hasta", type=date.fromisoformat, required=True, help="fecha final (AAAA-MM-DD)")
+    p.add_argument("--trabajador", action="append", default=[], help="solo este trabajador (se puede repetir)")
+    p.add_argument("--tardanza", type=int, default=app.ENTRY_DEADLINE,
+                   help="hora desde la que una entrada cuenta como tardanza (por defecto %(default)s)")
+    p.set_defaults(func=cmd_consultar_horas)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
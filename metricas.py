@@ -0,0 +1,188 @@
+"""
+Instrumentación liviana por etapas (spans): tiempo con reloj monótono, cantidad de llamadas
+y bytes procesados.
+
+    with span("parquet.leer") as s:
+        df = pd.read_parquet(...)
+        s.add_bytes(len(data))
+
+    @timed("marcacion")
+    def register_event(...): ...
+
+Cada span terminado:
+  - se acumula en un registro del proceso (histograma por etapa y últimas duraciones, que
+    muestra el panel de administración);
+  - se escribe como una línea JSON en el logger "registros.metricas" (nivel INFO). Streamlit
+    no configura ese logger: con la variable de entorno REGISTROS_METRICAS_LOG definida (por
+    ejemplo, REGISTROS_METRICAS_LOG=1) se le agrega un handler que escribe en stderr;
+  - si la variable de entorno REGISTROS_METRICAS_ARCHIVO está definida, se vuelca el
+    registro en ese archivo en formato de texto de Prometheus/OpenMetrics (como máximo
+    cada EXPORT_INTERVAL_SECONDS), para que lo lea el node_exporter u otro recolector.
+"""
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger("registros.metricas")
+if os.environ.get("REGISTROS_METRICAS_LOG") and not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+# Límites superiores (en segundos) de los buckets del histograma, como en Prometheus
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+RECENT_SAMPLES = 500          # Duraciones recientes que se guardan por etapa
+EXPORT_INTERVAL_SECONDS = 10  # Frecuencia máxima de escritura del archivo de Prometheus
+
+
+class _Stage:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.bytes = 0
+        self.buckets = [0] * len(BUCKETS)
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+
+class Span:
+    """Etapa en curso: permite sumar bytes y atributos que se registran al terminar."""
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.bytes = 0
+
+    def add_bytes(self, n):
+        self.bytes += n
+
+
+_lock = threading.Lock()
+_stages = {}
+_last_export = 0.0
+
+
+def _record(span, seconds, failed):
+    global _last_export
+    with _lock:
+        stage = _stages.setdefault(span.name, _Stage())
+        stage.calls += 1
+        stage.errors += failed
+        stage.seconds += seconds
+        stage.bytes += span.bytes
+        stage.recent.append(seconds)
+        for i, upper in enumerate(BUCKETS):
+            if seconds <= upper:
+                stage.buckets[i] += 1
+                break
+        path = os.environ.get("REGISTROS_METRICAS_ARCHIVO")
+        export = path and time.monotonic() - _last_export >= EXPORT_INTERVAL_SECONDS
+        if export:
+            _last_export = time.monotonic()
+
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps({
+            "span": span.name,
+            "ms": round(seconds * 1000, 3),
+            "bytes": span.bytes,
+            "error": failed,
+            **span.attrs
+        }, default=str))
+    if export:
+        write_prometheus(path)
+
+
+@contextmanager
+def span(name, **attrs):
+    """Mide el bloque como una etapa `name`; los atributos extra solo van al log."""
+    current = Span(name, attrs)
+    start = time.perf_counter()
+    failed = False
+    try:
+        yield current
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        _record(current, time.perf_counter() - start, failed)
+
+
+def timed(name):
+    """Decorador: mide cada llamada a la función como la etapa `name`."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def snapshot():
+    """
+    Resumen por etapa: {nombre: {llamadas, errores, segundos, bytes, recientes}}, donde
+    `recientes` son las últimas duraciones en segundos (la más nueva al final).
+    """
+    with _lock:
+        return {
+            name: {
+                "llamadas": stage.calls,
+                "errores": stage.errors,
+                "segundos": stage.seconds,
+                "bytes": stage.bytes,
+                "buckets": list(stage.buckets),
+                "recientes": list(stage.recent),
+            }
+            for name, stage in sorted(_stages.items())
+        }
+
+
+def reset():
+    """Borra todo lo registrado (para benchmarks)."""
+    with _lock:
+        _stages.clear()
+
+
+def prometheus_text():
+    """Registro actual en formato de texto de Prometheus/OpenMetrics."""
+    lines = [
+        "# HELP registros_etapa_segundos Duración de cada etapa instrumentada.",
+        "# TYPE registros_etapa_segundos histogram",
+    ]
+    data = snapshot()
+    for name, stage in data.items():
+        cumulative = 0
+        for upper, count in zip(BUCKETS, stage["buckets"]):
+            cumulative += count
+            le = "+Inf" if upper == float("inf") else repr(upper)
+            lines.append(f'registros_etapa_segundos_bucket{{etapa="{name}",le="{le}"}} {cumulative}')
+        lines.append(f'registros_etapa_segundos_sum{{etapa="{name}"}} {stage["segundos"]}')
+        lines.append(f'registros_etapa_segundos_count{{etapa="{name}"}} {stage["llamadas"]}')
+    for metric, key, help_text in (
+        ("registros_etapa_bytes", "bytes", "Bytes procesados por cada etapa."),
+        ("registros_etapa_errores", "errores", "Llamadas que terminaron con una excepción."),
+    ):
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} counter")
+        for name, stage in data.items():
+            lines.append(f'{metric}_total{{etapa="{name}"}} {stage[key]}')
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path):
+    """Escribe el registro en `path` de forma atómica (archivo temporal + reemplazo)."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w") as f:
+            f.write(prometheus_text())
+        os.replace(tmp, path)
+    except OSError:
+        logger.exception("No se pudo escribir el archivo de métricas %s", path)